@@ -29,6 +29,7 @@ import soundfile as sf
 from io import BytesIO
 import asyncio
 import threading
+import queue
 from google.cloud import texttospeech
 from langchain_google_vertexai import ChatVertexAI
 import random
@@ -36,7 +37,8 @@ import random
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from task_queue import input_text_queue, output_text_queue, gif_queue, image_queue, movement_queue, stt_queue
-from api import media_api, google_api, move_api, shell_api
+from intent_classifier import LocalIntentClassifier, IntentCache, PhraseMatcher, INTENT_EXAMPLES
+from api import media_api, google_api, move_api, shell_api, audio_api
 
 
 RES_DIR = "cartoons"
@@ -45,6 +47,35 @@ RES_DIR = "cartoons"
 GAME_TEXT = "Let's play! Rock! Paper! Scissor! Shoot!"
 ai_on = True
 
+# Number of concurrent requests when pre-synthesizing the canned phrases at startup
+TTS_WARMUP_WORKERS = 3
+
+# Only open the cloud stt stream after local voice activity detection hears speech
+USE_VAD = True
+# Send 16 kHz mono audio to the cloud stt instead of the 48 kHz stereo microphone input
+STT_DOWNMIX = True
+# End the utterance locally on trailing silence and a stable interim transcript instead of waiting for the cloud
+USE_ENDPOINTER = True
+# Classify short clear commands on the device, only the others are classified by gemini
+USE_LOCAL_INTENTS = True
+# Reuse the gemini intent of an utterance heard before, kept on disk across restarts
+USE_INTENT_CACHE = True
+# While asleep, listen for the wake phrases enrolled with audio_api.py 'enroll' on the device instead of the cloud
+USE_WAKE_SPOTTER = True
+
+# Speak conversation responses sentence by sentence while gemini is still generating
+STREAM_RESPONSES = True
+MAX_SPOKEN_WORDS = 15
+# Start the chat response while gemini is still classifying the intent, it is discarded if the intent is a command
+SPECULATIVE_CHAT = True
+
+# Start the camera as soon as a photo or game request is heard, a photo is captured ahead for a photo request
+CAMERA_PREFETCH = True
+PHOTO_WIDTH = 320
+
+# the chat conversation of gemini_task, speculative chat responses are generated on it from stt_task
+chat_conversation = None
+
 # Define voice parameters for different languages and a default voice
 voice0 = texttospeech.VoiceSelectionParams(language_code="en-US", name="en-US-Standard-E")
 voice_man = texttospeech.VoiceSelectionParams(language_code="en-US", name="en-US-Neural2-D")
@@ -62,12 +93,13 @@ lang_voices = {
 }
 cur_voice = voice0
 
-def get_voice(prompt=None):
+def get_voice(prompt=None, matches=None):
     """
     Determine the voice to be used based on the input prompt.
 
     Parameters:
     - prompt (str, optional): The input prompt that may contain language or voice type instructions.
+    - matches (dict, optional): The phrase_matcher matches of the prompt, if already found.
 
     Returns:
     - lang (str, optional): The detected language from the prompt.
@@ -76,13 +108,16 @@ def get_voice(prompt=None):
     if not prompt:
         logging.debug(f"select key voice: None,default is voice0")
         return None, voice0
-    if "man" in prompt:
+    if matches is None:
+        matches = phrase_matcher.match(prompt)
+    voices = dict(matches.get("voice", []))
+    if "man" in voices:
         logging.debug(f"select key voice: Man")
-        return None, voice_man
-    for key, value in lang_voices.items():
-        if key in prompt:
-            logging.info(f"select key: {key}")
-            return key, value
+        return voices["man"]
+    if voices:
+        key, value = next(iter(voices.values()))
+        logging.info(f"select key: {key}")
+        return key, value
     logging.info(f"no mapping, default is voice0")
     return None, voice0
 
@@ -104,75 +139,66 @@ move_cmd_functions = {
                  "dance": move_api.dance,
              }
 
-def classify_intent_with_gemini(user_input, conversation):
+def create_intent_classifier():
+    """
+    Creates the stateless intent classifier of a quadruped robot.
+
+    Returns:
+    - classifier (google_api.TextClassifier): The classifier, its labels are the keys of INTENT_EXAMPLES.
+    """
+    examples = "\n".join(f"{intent}: {phrases}" for intent, phrases in INTENT_EXAMPLES.items())
+    instructions = f"Classify what the user says to a quadruped robot.\n{examples}"
+    return google_api.TextClassifier(google_api.create_classifier_llm(), instructions,
+                                     INTENT_EXAMPLES.keys(), default="conversation")
+
+def get_cached_intent(user_input, cache):
+    """
+    Looks up the intent of a repeated utterance in the intent cache.
+
+    Parameters:
+    - user_input (str): The user's voice input
+    - cache (IntentCache): The intent cache, or None
+
+    Returns:
+    - result (tuple): (intent_name, confidence_level), or None if not cached
+    """
+    if cache is None:
+        return None
+    cached = cache.get(user_input)
+    if cached:
+        logging.info(f"Cached intent: {cached[0]}, Confidence: {cached[1]}, stats: {cache.stats()}")
+    return cached
+
+def classify_intent_with_gemini(user_input, classifier, cache=None, local_classifier=None, lookup=True):
     """
     Use Gemini AI to intelligently classify user intent.
     
     Parameters:
     - user_input (str): The user's voice input to classify
-    - conversation: Gemini conversation context for classification
+    - classifier (google_api.TextClassifier): The intent classifier from create_intent_classifier()
+    - cache (IntentCache, optional): If given, a repeated utterance uses the cached intent, and
+      high confidence intents are cached
+    - local_classifier (LocalIntentClassifier, optional): If given, high confidence intents fresh from
+      gemini are logged for its training, cached intents are not logged again
+    - lookup (bool): If False, the cache was already checked with get_cached_intent() and is only
+      filled
         
     Returns:
     - intent_name (str): The classified intent
     - confidence_level (str): The confidence level of classification
     """
-    intent_prompt = f"""
-You are an intent classifier for a quadruped robot. Classify the following user input into ONE of these intents:
-
-MOVEMENT INTENTS:
-- "movement_forward" - move forward, walk, come here, go forward, come to me
-- "movement_backward" - move backward, go back, reverse, back up
-- "movement_left" - move left, turn left, go left, left side
-- "movement_right" - move right, turn right, go right, right side
-
-BODY POSTURE INTENTS:
-- "posture_sit" - sit, sit down, squat, crouch
-- "posture_stand" - stand, stand up, action, init, get ready
-
-HEAD MOVEMENT INTENTS:
-- "head_up" - look up, head up, look at ceiling
-- "head_down" - look down, head down, look at ground
-- "head_left" - look left, turn head left, look that way
-- "head_right" - look right, turn head right, look over there
-
-SOCIAL INTENTS:
-- "dance" - dance, party, celebrate, boogie, dancing, let's dance
-- "photo" - take photo, picture, camera, smile, photograph, pic
-
-GAME INTENTS:
-- "game_rps" - rock paper scissors, game, play, じゃんけん, let's play
-
-SYSTEM INTENTS:
-- "system_sleep" - shut up, be quiet, sleep, hush, stop talking
-- "system_wake" - speak please, wake up, hello robot, start talking
-
-CONVERSATION INTENT:
-- "conversation" - general chat, questions, anything not covered above
-
-User input: "{user_input}"
-
-Respond with ONLY the intent name and confidence level separated by a comma.
-Example: "greeting,high"
-"""
-
-    try:
-        response = google_api.ai_text_response(conversation, intent_prompt)
-        response = response.strip().lower()
-        
-        if ',' in response:
-            intent, confidence = response.split(',', 1)
-            intent = intent.strip()
-            confidence = confidence.strip()
-        else:
-            intent = response.strip()
-            confidence = "medium"
-            
-        logging.info(f"Intent: {intent}, Confidence: {confidence}")
-        return intent, confidence
-        
-    except Exception as e:
-        logging.error(f"Error in intent classification: {e}")
-        return "conversation", "low"
+    if lookup:
+        cached = get_cached_intent(user_input, cache)
+        if cached:
+            return cached
+    intent, confidence = classifier.classify(user_input)
+    logging.info(f"Intent: {intent}, Confidence: {confidence}, stats: {classifier.stats()}")
+    if confidence == "high":
+        if cache is not None:
+            cache.put(user_input, intent, confidence)
+        if local_classifier is not None:
+            local_classifier.log(user_input, intent)
+    return intent, confidence
 
 # Single array with all intents - just add one line to add new commands!
 INTENT_CONFIG = [
@@ -194,12 +220,102 @@ INTENT_CONFIG = [
 # Convert to dictionary for fast lookup
 INTENT_MOVEMENTS = {intent: (movement, response) for intent, movement, response in INTENT_CONFIG}
 
-def execute_intent(intent, confidence, original_input):
+class SpeculativeChat:
+    """
+    A chat response generated while the intent of the same input is still being classified.
+
+    The response streams on a background thread without touching the conversation memory. If the
+    intent turns out to be conversation, the chat task speaks the sentences, which are often
+    already there, and only then saves the turn to the memory. Otherwise it is cancelled and
+    nothing is saved, so a discarded response never shows up in the conversation history.
+    """
+    def __init__(self, conversation, input_text):
+        self.conversation = conversation
+        self.input_text = input_text
+        self._sentences = queue.Queue()
+        self._response = []
+        self._cancelled = threading.Event()
+        self.failed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        stream = google_api.ai_text_response_stream(self.conversation, self.input_text, commit=False)
+        try:
+            for sentence in stream:
+                if self._cancelled.is_set():
+                    break
+                self._response.append(sentence)
+                self._sentences.put(sentence)
+        except Exception as e:
+            logging.error(f"speculative chat error: {e}")
+            self.failed = True
+        finally:
+            stream.close()
+            self._sentences.put(None)
+
+    def cancel(self):
+        """
+        Discards the response, the stream stops at the next sentence.
+        """
+        if not self._cancelled.is_set():
+            logging.debug(f"speculative chat discarded: {self.input_text}")
+            self._cancelled.set()
+
+    def sentences(self):
+        """
+        Yields the response sentences, then saves the turn to the conversation memory.
+        If the speculative stream failed before any sentence, the response is generated again
+        with a normal stream, so the turn is not lost.
+
+        Yields:
+        - sentence (str): Each sentence of the response as soon as it is complete.
+        """
+        while True:
+            sentence = self._sentences.get()
+            if sentence is None:
+                break
+            yield sentence
+        if self.failed and not self._response and not self._cancelled.is_set():
+            logging.debug("speculative chat failed, generate the response again")
+            yield from google_api.ai_text_response_stream(self.conversation, self.input_text)
+            return
+        if not self._cancelled.is_set() and self._response:
+            google_api.commit_response(self.conversation, self.input_text, " ".join(self._response))
+
+def prepare_camera(matches, intent=None):
+    """
+    Starts the camera work a photo or game request will need while the request is still routed.
+
+    A photo request gets its photo captured ahead, which the photo branch of gemini_task takes
+    over. The game only warms the camera up, because its photo must show the hand at "Shoot!".
+
+    Parameters:
+    - matches (dict): The phrase_matcher matches of the input.
+    - intent (str, optional): The classified intent, once known.
+    """
+    if not CAMERA_PREFETCH:
+        return
+    # each request is prepared once, from the phrases if they match, else from the intent
+    if (intent is None and "photo" in matches) or (intent == "photo" and "photo" not in matches):
+        media_api.prefetch_photo(width=PHOTO_WIDTH)
+    elif (intent is None and "game" in matches) or (intent == "game_rps" and "game" not in matches):
+        media_api.warm_camera()
+
+def execute_intent(intent, confidence, original_input, speculation=None):
     """
     Execute actions based on classified intent.
+
+    A speculative chat response of the input is handed to the chat task if the intent is
+    conversation, and cancelled otherwise.
     """
     logging.info(f"Executing intent: {intent} (confidence: {confidence})")
     
+    if speculation is not None and (intent in INTENT_MOVEMENTS or
+                                    intent in ("photo", "game_rps", "system_sleep", "system_wake")):
+        speculation.cancel()
+        speculation = None
+
     # Handle movement intents from the array
     if intent in INTENT_MOVEMENTS:
         movement, response = INTENT_MOVEMENTS[intent]
@@ -224,42 +340,41 @@ def execute_intent(intent, confidence, original_input):
     # Fallback to conversation
     else:
         logging.debug(f"put voice text to input queue: {original_input}")
-        input_text_queue.put(original_input)
+        input_text_queue.put(speculation if speculation is not None else original_input)
         return False
     
     return True
 
-def get_move_cmd(input_text, command_dict):
+def get_move_cmd(input_text, matches=None):
     """
-    Find the command key in the input text based on the command dictionary.
+    Find the first movement command key of move_cmd_functions in the input text.
 
     Parameters:
     - input_text (str): The input text to search within.
-    - command_dict (dict): The dictionary of command keys.
+    - matches (dict, optional): The phrase_matcher matches of the input text, if already found.
 
     Returns:
     - command_key (str, optional): The found command key or None if not found.
     """
     if not input_text:
         return None
-    for command_key in command_dict.keys():
-        if re.search(r'\b' + re.escape(command_key) + r'\b', input_text):
-            return command_key
-    return None
+    if matches is None:
+        matches = phrase_matcher.match(input_text)
+    moves = matches.get("move")
+    return moves[0][0] if moves else None
 
 def close_ai():
     global ai_on
     ai_on = False
+    google_api.stop_speaking()
     stt_queue.put(True)
-    image = Image.open(f"{RES_DIR}/logo2.png")
-    image_queue.put(image)
+    image_queue.put("logo2.png")
 
 def open_ai():
     global ai_on
     ai_on = True
     stt_queue.put(True)
-    image = Image.open(f"{RES_DIR}/hello.png")
-    image_queue.put(image)
+    image_queue.put("hello.png")
     output_text_queue.put("OK, my friend.")
 
 def reboot():
@@ -277,14 +392,39 @@ sys_cmds_functions = {
         "power off": power_off,
         }
 
-def get_sys_cmd(input_text, command_dict):
-    normalized_text = re.sub(r'[^\w\s]', '', input_text.lower())
+def get_sys_cmd(input_text, matches=None):
+    """
+    Find the system command of sys_cmds_functions that is the whole input text.
 
-    for command_key in command_dict.keys():
-        if normalized_text == command_key.lower():
-            return command_key, command_dict[command_key]
+    Parameters:
+    - input_text (str): The input text.
+    - matches (dict, optional): The phrase_matcher matches of the input text, if already found.
 
-    return None, None
+    Returns:
+    - command_key (str, optional): The command key or None if not found.
+    - command_func (callable, optional): The command function or None if not found.
+    """
+    if matches is None:
+        matches = phrase_matcher.match(input_text)
+    commands = matches.get("sys")
+    return commands[0] if commands else (None, None)
+
+# Phrases that wake the ai up, start a photo description or the rock paper scissors game
+WAKE_UP_PHRASES = ["speak please", "wake up", "hello robot", "start talking", "turn on"]
+PHOTO_PHRASES = ["photo", "photos", "photograph", "photographs", "photography", "picture", "pictures",
+                 "expression", "expressions", "facial expression", "写真"]
+GAME_PHRASES = ["rock paper scissors"]
+VOICE_PHRASES = {"man": (None, voice_man), **{key: (key, value) for key, value in lang_voices.items()}}
+
+# All routing phrases, matched in one pass per utterance, system commands must be the whole utterance
+phrase_matcher = PhraseMatcher({
+    "move": move_cmd_functions,
+    "sys": sys_cmds_functions,
+    "voice": VOICE_PHRASES,
+    "wake": WAKE_UP_PHRASES,
+    "photo": PHOTO_PHRASES,
+    "game": GAME_PHRASES,
+}, exact=("sys",))
 
 
 def cut_text_by_last_period(text, max_words_before_period=15):
@@ -345,6 +485,31 @@ def remove_emojis(text):
     return emoji_pattern.sub(r'', text)
 
 
+def clean_tts_text(text):
+    """
+    Remove the characters tts should not read.
+
+    Parameters:
+    - text (str): The text to clean.
+
+    Returns:
+    - text (str): The cleaned text.
+    """
+    return remove_emojis(text).replace('*', '')
+
+
+def canned_phrases():
+    """
+    Collect the fixed phrases the robot speaks, cleaned the same way tts_task does.
+
+    Returns:
+    - phrases (list): The phrases.
+    """
+    phrases = [response for _, _, response in INTENT_CONFIG]
+    phrases += [GAME_TEXT, "OK, my friend.", "You win!", "It's a tie!", "You lose!"]
+    return [clean_tts_text(cut_text_by_last_period(phrase)) for phrase in dict.fromkeys(phrases)]
+
+
 def stt_task():
     """
     Task for speech-to-text conversion with enhanced intent recognition.
@@ -352,7 +517,30 @@ def stt_task():
     logging.debug("stt task start.")
     py_audio = google_api.init_pyaudio()
     speech_client = google_api.init_speech_to_text()
-    intent_conversation = google_api.create_conversation()
+    intent_classifier = create_intent_classifier()
+    local_intents = LocalIntentClassifier(INTENT_EXAMPLES) if USE_LOCAL_INTENTS else None
+    intent_cache = IntentCache() if USE_INTENT_CACHE else None
+    mic = audio_api.MicrophoneRing(py_audio)
+    mic.start()
+    resampler = audio_api.Resampler() if STT_DOWNMIX else None
+    vad = None
+    endpointer = None
+    detector = None
+    if USE_VAD or USE_ENDPOINTER or USE_WAKE_SPOTTER:
+        if resampler:
+            detector = audio_api.VoiceActivityDetector(rate=audio_api.STT_RATE, channels=audio_api.STT_CHANNELS)
+        else:
+            detector = audio_api.VoiceActivityDetector()
+        if USE_VAD:
+            vad = detector
+        if USE_ENDPOINTER:
+            endpointer = audio_api.Endpointer(detector)
+    spotter = None
+    if USE_WAKE_SPOTTER and resampler:
+        spotter = audio_api.KeywordSpotter()
+        if not spotter.has_templates():
+            logging.info("no wake phrase enrolled, use the cloud stt while asleep")
+            spotter = None
     logging.debug("init stt.")
 
     while True:
@@ -367,15 +555,34 @@ def stt_task():
 
         if not should_stt:
             continue
+        if not ai_on and spotter:
+            logging.debug("ai is not on, listening for the wake phrase on the device ... ...")
+            cursor = mic.cursor()
+            resampler.reset()
+            phrase = spotter.listen(lambda: resampler.process(cursor.read()), detector)
+            cursor.close()
+            if phrase:
+                logging.info(f"Wake up phrase {phrase} detected!")
+                open_ai()
+            else:
+                stt_queue.put(True)
+            continue
         logging.debug("stt task start loop, listening ... ...")
-        user_input, stream = google_api.start_speech_to_text(speech_client, py_audio)
+        user_input, stream = google_api.start_speech_to_text(speech_client, py_audio, vad=vad,
+                                                             resampler=resampler, source=mic,
+                                                             endpointer=endpointer)
+        # the stream is a cursor on the always-on microphone, closing it at once is safe
+        google_api.stop_speech_to_text(stream)
         logging.debug(f"voice input: {user_input}")
 
-        move_key = get_move_cmd(user_input, move_cmd_functions)
-        sys_cmd_key, sys_cmd_func = get_sys_cmd(user_input, sys_cmds_functions)
+        matches = phrase_matcher.match(user_input)
+        logging.debug(f"matched phrase categories: {list(matches)}")
+        move_key = get_move_cmd(user_input, matches)
+        sys_cmd_key, sys_cmd_func = get_sys_cmd(user_input, matches)
         global cur_voice
         if ai_on:
-            lang, cur_voice = get_voice(user_input)
+            lang, cur_voice = get_voice(user_input, matches)
+            prepare_camera(matches)
 
         if not user_input:
             logging.debug(f"no input!")
@@ -385,21 +592,38 @@ def stt_task():
             sys_cmd_func()
         elif not ai_on:
             # ADD THIS: Check for wake-up commands when AI is off
-            wake_up_phrases = ["speak please", "wake up", "hello robot", "start talking", "turn on"]
-            if any(wake_phrase in user_input.lower() for wake_phrase in wake_up_phrases):
+            if "wake" in matches:
                 logging.info("Wake up command detected!")
                 open_ai()
             else:
                 logging.info(f"ai is not on, do not use gemini")
                 stt_queue.put(True)
-                time.sleep(0.5)
-                google_api.stop_speech_to_text(stream)
-                time.sleep(0.5)
                 continue
         else:
+            speculation = None
             try:
-                intent, confidence = classify_intent_with_gemini(user_input, intent_conversation)
-                handled = execute_intent(intent, confidence, user_input)
+                intent = None
+                if local_intents:
+                    intent, score = local_intents.classify(user_input)
+                    confidence = "high"
+                    logging.info(f"Local intent: {intent}, score: {score:.2f}, stats: {local_intents.stats()}")
+                if not intent:
+                    cached = get_cached_intent(user_input, intent_cache)
+                    if cached:
+                        intent, confidence = cached
+                if not intent:
+                    # only an uncached utterance waits for gemini, photo and game requests are answered
+                    # from the camera, there is nothing to speculate
+                    if SPECULATIVE_CHAT and chat_conversation is not None and \
+                            "photo" not in matches and "game" not in matches:
+                        speculation = SpeculativeChat(chat_conversation, user_input)
+                    intent, confidence = classify_intent_with_gemini(user_input, intent_classifier, cache=intent_cache,
+                                                                     local_classifier=local_intents, lookup=False)
+                prepare_camera(matches, intent)
+                handled = execute_intent(intent, confidence, user_input, speculation)
+                # only the photo branch of gemini_task takes over a prefetched photo
+                if handled or not (intent == "photo" or "photo" in matches):
+                    media_api.discard_prefetch()
                 
                 if handled:
                     stt_queue.put(True)
@@ -408,21 +632,22 @@ def stt_task():
                     
             except Exception as e:
                 logging.error(f"Error in intent processing: {e}")
-                input_text_queue.put(user_input)
+                if "photo" not in matches:
+                    media_api.discard_prefetch()
+                input_text_queue.put(speculation if speculation is not None else user_input)
                 stt_queue.put(False)
-        time.sleep(0.5)
-        google_api.stop_speech_to_text(stream)
-        time.sleep(0.5)
 
 def gemini_task():
     """
     Task for handling Gemini AI interactions.
     """
     logging.debug("gemini task start.")
+    global chat_conversation
     conversation = google_api.create_conversation()
     init_input =  "From here on, always answer as if a human being is saying things off the top of his head which is always concise, relevant and contains a good conversational tone. so you will only and only answer in one breathe responses. If the input contains a language other than English, for example, language A, please answer the question in language A."
     response = google_api.ai_text_response(conversation, init_input)
     logging.debug(f"init llm and first response: {response}")
+    chat_conversation = conversation
 
     multi_model = ChatVertexAI(model="gemini-2.0-flash")
     with Image.open(f"{RES_DIR}/Trot.jpg") as image:
@@ -434,34 +659,42 @@ def gemini_task():
             response = google_api.ai_image_response(multi_model, image=image, text=text_prompt)
     logging.debug(f"init vision model and first response: {response}")
     stt_queue.put(True)
-    image = Image.open(f"{RES_DIR}/hello.png")
-    image_queue.put(image)
+    image_queue.put("hello.png")
 
     while True:
         logging.debug("tts wait for gemini responese text... ...")
         input_text = input_text_queue.get()
         input_text_queue.task_done()
+        speculation = None
+        if isinstance(input_text, SpeculativeChat):
+            speculation = input_text
+            input_text = speculation.input_text
         if not ai_on:
+            if speculation:
+                speculation.cancel()
             continue
 
         logging.debug(f"user input from voice: {input_text}")
         stt_queue.put(False)
         user_input = input_text
         response = ""
+        matches = phrase_matcher.match(user_input)
+        if speculation and ("photo" in matches or "game" in matches):
+            speculation.cancel()
+            speculation = None
         if not user_input:
             logging.debug(f"no input!")
 
-        elif "photo" in user_input or "picture" in user_input or "xpression" in user_input or "写真" in user_input:
+        elif "photo" in matches:
             ms_start = int(time.time() * 1000)
             logging.debug(f"detect pic start!")
-            image = media_api.take_photo()
+            image = media_api.take_photo(width=PHOTO_WIDTH)
             logging.debug(f"take photo finish!")
 
             if image:
-                image = media_api.resize_image_to_width(image, 320)
-                logging.debug(f"resize photo finish!")
                 #response = google_api.ai_image_response(multi_model, image=image, text="この写真を読んで俳句を作ってください。大喜利大会なのでそれも踏まえて考えてください。俳句の前には必ず「いい写真ですね。では一句。」とつけてください。")
-                response = google_api.ai_image_response(multi_model, image=image, text=user_input)
+                response = google_api.ai_image_response(multi_model, image=image, text=user_input,
+                                                        cache=google_api.vision_cache)
                 image_queue.put(image)
             else:
                 response = google_api.ai_text_response(conversation, user_input)
@@ -472,7 +705,7 @@ def gemini_task():
             logging.debug("picture response end: {response}")
             output_text_queue.put(response)
 
-        elif "rock paper scissors" in user_input:
+        elif "game" in matches:
             ms_start = int(time.time() * 1000)
             logging.debug(f"play game take photo")
             human_image = media_api.take_photo()
@@ -484,9 +717,9 @@ def gemini_task():
             random.seed(int(time.time()))
             puppy_gesture = random.choice(gestures)
             logging.debug(f"puppy_gesture is: {puppy_gesture}")
-            puppy_image = Image.open(f"{RES_DIR}/{puppy_gesture}.jpg")
-            image_queue.put(puppy_image)
+            image_queue.put(f"{puppy_gesture}.jpg")
 
+            # no vision cache here, each round is the same scene with a different hand
             human_gesture = google_api.ai_image_response(multi_model, image=human_image, text=user_input)
             human_gesture = human_gesture.replace(' ', '')
             logging.debug(f"human_gesture is: {human_gesture}")
@@ -495,17 +728,56 @@ def gemini_task():
             result = "You win!" if win_conditions.get(human_gesture) == puppy_gesture else ("It's a tie!" if human_gesture == puppy_gesture else "You lose!")
             response = result
             output_text_queue.put(response)
-            image = Image.open(f"{RES_DIR}/logo.png")
-            image_queue.put(image)
+            image_queue.put("logo.png")
         else:
             logging.debug("text response start!")
             #gif_queue.put(True)
-            response = google_api.ai_text_response(conversation, user_input)
-            logging.debug("text response end: {response}")
-            output_text_queue.put(response)
+            if speculation:
+                logging.debug("use the speculative response")
+                if STREAM_RESPONSES:
+                    speak_stream(speculation.sentences())
+                else:
+                    output_text_queue.put(" ".join(speculation.sentences()))
+            elif STREAM_RESPONSES:
+                speak_stream(google_api.ai_text_response_stream(conversation, user_input))
+            else:
+                response = google_api.ai_text_response(conversation, user_input)
+                logging.debug("text response end: {response}")
+                output_text_queue.put(response)
         time.sleep(0.05)
 
 
+def speak_stream(sentences, max_words=MAX_SPOKEN_WORDS):
+    """
+    Send streamed sentences to tts as soon as each one is complete.
+
+    Like cut_text_by_last_period, the first sentence is always spoken and the following ones
+    only until the first one that would take the spoken text over max_words. The rest of the stream is still read
+    so the whole response is kept in the conversation memory.
+
+    Parameters:
+    - sentences (iterable): The sentences from google_api.ai_text_response_stream.
+    - max_words (int): The maximum number of words to speak.
+    """
+    words = 0
+    full = False
+    try:
+        for sentence in sentences:
+            if full:
+                continue
+            count = len(sentence.split())
+            if words and words + count > max_words:
+                # speak a contiguous prefix only, nothing after the first sentence that does not fit
+                full = True
+                continue
+            words += count
+            output_text_queue.put((sentence, False))
+    except Exception as e:
+        logging.error(f"text response stream error: {e}")
+    # the final marker lets tts re-enable stt after the last sentence
+    output_text_queue.put(("", True))
+
+
 def tts_task():
     """
     Task for text-to-speech conversion and audio output.
@@ -516,24 +788,36 @@ def tts_task():
     global voice0, cur_voice
     voice0 = voice
     cur_voice = voice
+    voices = {v.name: v for v in [voice, voice_man, *lang_voices.values()]}
+    google_api.warm_tts_cache(canned_phrases(), tts_client, list(voices.values()), audio_config,
+                              max_workers=TTS_WARMUP_WORKERS)
     logging.debug("init tts end.")
     while True:
         logging.debug("tts wait for gemini responese text... ...")
         out_text = output_text_queue.get()
-        out_text = cut_text_by_last_period(out_text)
         output_text_queue.task_done()
-        out_text = remove_emojis(out_text).replace('*', '')
+        if isinstance(out_text, tuple):
+            # streamed sentence, stt stays off until the final one
+            out_text, final = out_text
+        else:
+            out_text = cut_text_by_last_period(out_text)
+            final = True
+        out_text = clean_tts_text(out_text)
         if not out_text or not ai_on:
-            stt_queue.put(True)
+            if final:
+                # the streamed sentences before the final marker may still be playing
+                google_api.wait_speaking()
+                stt_queue.put(True)
             continue
 
         stt_queue.put(False)
-        google_api.text_to_speech(out_text, tts_client, cur_voice, audio_config)
+        # a streamed sentence is only queued, so its synthesis overlaps the playback of the one before
+        google_api.text_to_speech(out_text, tts_client, cur_voice, audio_config, wait=final)
         
         if GAME_TEXT == out_text:
             text = "I am playing rock paper scissors. Tell me what is this? rock paper or scissors? Only in one word, no punctuation and all in lowercase."
             input_text_queue.put(text)
-        else:
+        elif final:
             time.sleep(0.02)
             stt_queue.put(True)
 
@@ -558,12 +842,16 @@ def image_task():
     Task for handling image display.
     """
     logging.debug("image task start.")
+    media_api.get_assets().preload()
     logging.debug("init image end.")
     while True:
         logging.debug("wait for image show... ...")
         image = image_queue.get()
         image_queue.task_done()
-        media_api.show_image(image)
+        if isinstance(image, str):
+            media_api.show_asset(image)
+        else:
+            media_api.show_image(image)
         time.sleep(0.02)
 
 def move_task():
@@ -609,6 +897,11 @@ def main():
     lang_code = os.environ.get('LANGUAGE_CODE', 'en-US')
     lang_name = os.environ.get('LANGUAGE_NAME', 'en-US-Standard-E')
     google_api.set_language(lang_code, lang_name)
+    google_api.set_image_encoding(
+        long_edge=int(os.environ.get('IMAGE_LONG_EDGE', google_api.image_long_edge)),
+        quality=int(os.environ.get('IMAGE_JPEG_QUALITY', google_api.image_jpeg_quality)),
+        max_bytes=int(os.environ.get('IMAGE_MAX_BYTES', google_api.image_max_bytes)),
+    )
 
     stt_thread = threading.Thread(target=stt_task)
     stt_thread.start()
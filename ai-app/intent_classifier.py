@@ -0,0 +1,661 @@
+#
+# Copyright 2024 MangDang (www.mangdang.net)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Description: On-device intent classifier, it handles short clear commands such as "sit down" at once and leaves
+# the ambiguous input, single words included, to the cloud intent classifier. It learns from the example phrases of each intent and
+# from the utterances the cloud classifier labelled before. The intents the cloud gives are also cached by
+# normalized utterance, so a repeated command is not classified again. A phrase matcher finds the command
+# phrases of all routing categories in one pass.
+#
+# Classify Test Method: Type 'try', then press enter. Type a sentence, the intent, the score and the delay
+# are printed.
+# Evaluation Test Method: Type 'eval', then press enter. The precision, the coverage and the delay over the
+# logged utterances are printed.
+# Correction Test Method: Type 'forget', press enter, then type a sentence that was given a wrong intent, then press
+# enter. The sentence is removed from the log and the intent cache.
+#
+
+import logging
+import os
+import re
+import json
+import time
+import threading
+import collections
+import numpy as np
+
+# logged utterances with the intent the cloud classifier gave them, one json object per line
+INTENT_LOG_PATH = os.path.expanduser("~/.local/share/apps-md-robots/intent_log.jsonl")
+INTENT_LOG_MAX_LINES = 5000
+# logged utterances used to evaluate the classifier, and the folds they are split into
+INTENT_EVAL_MAX_SAMPLES = 1000
+INTENT_EVAL_FOLDS = 5
+
+# an intent is accepted locally when its similarity is at least the threshold and ahead of the next one by the margin
+LOCAL_INTENT_THRESHOLD = 0.55
+LOCAL_INTENT_MARGIN = 0.15
+
+NGRAM_SIZES = (3, 4, 5)
+
+# cloud intent results kept by normalized utterance, on disk across restarts
+INTENT_CACHE_PATH = os.path.expanduser("~/.cache/apps-md-robots/intent_cache.json")
+INTENT_CACHE_MAX_ENTRIES = 1000
+INTENT_CACHE_TTL = 7 * 24 * 3600
+
+# Intent labels with a few example phrases, these are the only answers the intent classifiers give.
+# The app's own command phrases, such as "move forwards", are listed so they are handled locally.
+INTENT_EXAMPLES = {
+    "movement_forward": "move forward, move forwards, walk, come here, come to me",
+    "movement_backward": "move backward, move backwards, go back, reverse, back up",
+    "movement_left": "move left, turn left, go left",
+    "movement_right": "move right, turn right, go right",
+    "posture_sit": "sit, sit down, squat, crouch",
+    "posture_stand": "stand, stand up, action, get ready",
+    "head_up": "look up, head up",
+    "head_down": "look down, head down",
+    "head_left": "look left, turn head left",
+    "head_right": "look right, turn head right",
+    "dance": "dance, party, celebrate, let's dance",
+    "photo": "take photo, take a picture, picture, camera, smile, photograph",
+    "game_rps": "rock paper scissors, game, let's play, じゃんけん",
+    "system_sleep": "shut up, be quiet, sleep, hush, stop talking",
+    "system_wake": "speak please, wake up, hello robot, start talking, turn on",
+    "conversation": "general chat, questions, anything else",
+}
+
+# words that carry no intent, every other word of an utterance must be known to the intent to accept it locally
+FILLER_WORDS = {
+    "a", "an", "the", "please", "now", "can", "could", "would", "will", "you", "me", "for", "to", "and",
+    "hey", "ok", "okay", "little", "bit", "again", "just", "let's", "lets", "do", "some",
+}
+
+
+def normalize(text):
+    """
+    Lowercases a text and replaces punctuation with spaces.
+
+    Parameters:
+    - text (str): The text.
+
+    Returns:
+    - text (str): The normalized text.
+    """
+    return " ".join(re.sub(r"[^\w']+", " ", text.lower()).split())
+
+
+def char_ngrams(text):
+    """
+    Returns the character n-grams of a normalized text, each word padded with spaces.
+    """
+    grams = []
+    for word in text.split():
+        padded = f" {word} "
+        for n in NGRAM_SIZES:
+            grams.extend(padded[i:i + n] for i in range(max(1, len(padded) - n + 1)))
+    return grams
+
+
+def strip_fillers(text):
+    """
+    Removes the filler words from a normalized text, "sit down please" becomes "sit down".
+    """
+    return " ".join(word for word in text.split() if word not in FILLER_WORDS)
+
+
+class LocalIntentClassifier:
+    """
+    Classifies an utterance with an exact phrase match, then with character n-gram TF-IDF
+    vectors compared to one centroid per intent.
+
+    The example phrases of two words or more, also with the filler words removed, are accepted
+    at once. Any other utterance of a single word, such as "play" or "smile", is left to the
+    cloud, it is too ambiguous to route locally. Otherwise the
+    nearest intent is accepted only when it is similar enough, clearly ahead of the second one
+    and every word of the utterance is a filler word or a word seen for that intent, else the
+    utterance is left to the cloud. The last check keeps "look up the weather" away from "look up".
+
+    Logged utterances only refine the centroids and the known words, they never become exact
+    phrases, so one wrong cloud label can not take over an utterance. Each utterance counts once,
+    with the intent it was logged with last.
+    """
+    def __init__(self, examples, log_path=INTENT_LOG_PATH, threshold=LOCAL_INTENT_THRESHOLD,
+                 margin=LOCAL_INTENT_MARGIN):
+        self.examples = {intent: [normalize(phrase) for phrase in
+                                  (phrases.split(",") if isinstance(phrases, str) else phrases)]
+                         for intent, phrases in examples.items()}
+        self.log_path = log_path
+        self.threshold = threshold
+        self.margin = margin
+        self._lock = threading.Lock()
+        self.local = 0
+        self.deferred = 0
+        self.delay_ms = 0.0
+        self._log_lines = 0
+        self.train(self.load_log())
+
+    def load_log(self):
+        """
+        Reads the logged utterances.
+
+        Returns:
+        - samples (list): (text, intent) pairs, oldest first.
+        """
+        samples = []
+        if not self.log_path or not os.path.exists(self.log_path):
+            return samples
+        lines = 0
+        try:
+            with open(self.log_path, encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                        samples.append((normalize(entry["text"]), entry["intent"]))
+                    except (ValueError, KeyError):
+                        continue
+        except OSError as e:
+            logging.error(f"intent log read error: {e}")
+        self._log_lines = lines
+        return samples[-INTENT_LOG_MAX_LINES:]
+
+    @staticmethod
+    def _dedupe(samples):
+        # the last intent of an utterance wins, and it counts once however often it was logged
+        latest = {}
+        for text, intent in samples:
+            if text:
+                latest.pop(text, None)
+                latest[text] = intent
+        return list(latest.items())
+
+    def train(self, samples=()):
+        """
+        Builds the phrase table and the intent centroids from the examples and the given samples.
+
+        Parameters:
+        - samples (list): (text, intent) pairs, such as the logged utterances.
+        """
+        texts = []
+        labels = []
+        phrases = {}
+        for intent, examples in self.examples.items():
+            texts.extend(examples)
+            labels.extend([intent] * len(examples))
+            for text in examples:
+                # a phrase given for two intents is ambiguous, keep it out of the exact match table
+                for key in (text, strip_fillers(text)):
+                    if len(key.split()) > 1:
+                        phrases[key] = intent if phrases.get(key, intent) == intent else None
+        for text, intent in self._dedupe(samples):
+            texts.append(text)
+            labels.append(intent)
+
+        vocabulary = {}
+        documents = []
+        for text in texts:
+            counts = collections.Counter(char_ngrams(text))
+            for gram in counts:
+                vocabulary.setdefault(gram, len(vocabulary))
+            documents.append(counts)
+        document_frequency = np.zeros(len(vocabulary), dtype=np.float32)
+        for counts in documents:
+            for gram in counts:
+                document_frequency[vocabulary[gram]] += 1
+        idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+
+        intents = sorted(set(labels))
+        centroids = np.zeros((len(intents), len(vocabulary)), dtype=np.float32)
+        index = {intent: i for i, intent in enumerate(intents)}
+        for counts, intent in zip(documents, labels):
+            centroids[index[intent]] += self._vector(counts, vocabulary, idf)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroids /= np.maximum(norms, 1e-10)
+
+        words = collections.defaultdict(set)
+        for text, intent in zip(texts, labels):
+            words[intent].update(text.split())
+
+        with self._lock:
+            self._phrases = {text: intent for text, intent in phrases.items() if intent}
+            self._words = dict(words)
+            self._vocabulary = vocabulary
+            self._idf = idf
+            self._intents = intents
+            self._centroids = centroids
+        logging.debug(f"local intent classifier trained on {len(texts)} phrases, {len(vocabulary)} n-grams")
+
+    @staticmethod
+    def _vector(counts, vocabulary, idf):
+        vector = np.zeros(len(vocabulary), dtype=np.float32)
+        for gram, count in counts.items():
+            i = vocabulary.get(gram)
+            if i is not None:
+                vector[i] = (1 + np.log(count)) * idf[i]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def scores(self, text):
+        """
+        Returns the similarity of a text to each intent.
+
+        Parameters:
+        - text (str): The text.
+
+        Returns:
+        - scores (list): (intent, similarity) pairs, the most similar first.
+        """
+        with self._lock:
+            vector = self._vector(collections.Counter(char_ngrams(normalize(text))), self._vocabulary, self._idf)
+            similarities = self._centroids @ vector
+            intents = self._intents
+        order = np.argsort(similarities)[::-1]
+        return [(intents[i], float(similarities[i])) for i in order]
+
+    def predict(self, text):
+        """
+        Classifies a text without counting it in the statistics.
+
+        Parameters:
+        - text (str): The text.
+
+        Returns:
+        - intent (str): The intent, or None if the text should be classified in the cloud.
+        - score (float): 1.0 for an exact phrase, else the similarity to the intent.
+        """
+        normalized = normalize(text)
+        stripped = strip_fillers(normalized)
+        intent = self._phrases.get(normalized) or self._phrases.get(stripped)
+        if intent:
+            return intent, 1.0
+        if len(stripped.split()) < 2:
+            return None, 0.0
+        scores = self.scores(normalized)
+        best_intent, best = scores[0]
+        second = scores[1][1] if len(scores) > 1 else 0.0
+        known = self._words.get(best_intent, set())
+        covered = all(word in known or word in FILLER_WORDS for word in normalized.split())
+        if covered and best >= self.threshold and best - second >= self.margin:
+            return best_intent, best
+        return None, best
+
+    def classify(self, text):
+        """
+        Classifies a text and records the delay and whether it was handled locally.
+
+        Parameters:
+        - text (str): The text.
+
+        Returns:
+        - intent (str): The intent, or None if the text should be classified in the cloud.
+        - score (float): 1.0 for an exact phrase, else the similarity to the intent.
+        """
+        start = time.perf_counter()
+        intent, score = self.predict(text)
+        delay = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.delay_ms += delay
+            if intent:
+                self.local += 1
+            else:
+                self.deferred += 1
+        logging.debug(f"local intent: {intent}, score {score:.2f}, {delay:.1f}ms")
+        return intent, score
+
+    def log(self, text, intent):
+        """
+        Appends an utterance and its intent from the cloud classifier to the log, used at the next training.
+        Log only fresh cloud classifications, a cached intent would count the same utterance again.
+
+        Parameters:
+        - text (str): The utterance.
+        - intent (str): The intent.
+        """
+        if not self.log_path or not text:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"text": text, "intent": intent, "time": int(time.time())}, ensure_ascii=False) + "\n")
+            self._log_lines += 1
+        except OSError as e:
+            logging.error(f"intent log write error: {e}")
+            return
+        # trim with some slack, so the file is not rewritten on every line
+        if self._log_lines > INTENT_LOG_MAX_LINES * 1.2:
+            self._rewrite_log(lambda lines: lines[-INTENT_LOG_MAX_LINES:])
+
+    def _rewrite_log(self, edit):
+        try:
+            with open(self.log_path, encoding="utf-8") as f:
+                lines = edit(f.readlines())
+            tmp_path = f"{self.log_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(lines)
+            os.replace(tmp_path, self.log_path)
+            self._log_lines = len(lines)
+        except OSError as e:
+            logging.error(f"intent log rewrite error: {e}")
+
+    def forget(self, text):
+        """
+        Removes an utterance from the log and retrains, such as to correct a wrong cloud label.
+
+        Parameters:
+        - text (str): The utterance.
+
+        Returns:
+        - removed (int): The log lines removed.
+        """
+        key = normalize(text)
+        removed = 0
+        if self.log_path and os.path.exists(self.log_path):
+            def keep(line):
+                try:
+                    return normalize(json.loads(line)["text"]) != key
+                except (ValueError, KeyError):
+                    return True
+            before = self._log_lines
+            self._rewrite_log(lambda lines: [line for line in lines if keep(line)])
+            removed = before - self._log_lines
+        self.train(self.load_log())
+        logging.info(f"forgot {removed} logged lines of: {key}")
+        return removed
+
+    def evaluate(self, samples=None, folds=INTENT_EVAL_FOLDS, max_samples=INTENT_EVAL_MAX_SAMPLES):
+        """
+        Measures the precision and the coverage on labelled samples with k-fold cross validation, each
+        fold is classified by a classifier trained on the other folds, so the logged utterances can
+        be used as the test set. Only the most recent samples are used, to keep it quick on the robot.
+
+        Parameters:
+        - samples (list, optional): (text, intent) pairs, the logged utterances by default.
+        - folds (int): The number of folds.
+        - max_samples (int): The most recent samples used.
+
+        Returns:
+        - results (dict): The samples, the share classified locally, the precision of those and
+          the mean delay in ms.
+        """
+        samples = self.load_log() if samples is None else [(normalize(text), intent) for text, intent in samples]
+        samples = self._dedupe(samples)[-max_samples:]
+        if not samples:
+            return {"samples": 0}
+        held_out = LocalIntentClassifier(self.examples, log_path=None, threshold=self.threshold, margin=self.margin)
+        folds = max(2, min(folds, len(samples)))
+        accepted = 0
+        correct = 0
+        delay = 0.0
+        for fold in range(folds):
+            held_out.train([sample for i, sample in enumerate(samples) if i % folds != fold])
+            for text, intent in samples[fold::folds]:
+                start = time.perf_counter()
+                predicted, _ = held_out.predict(text)
+                delay += (time.perf_counter() - start) * 1000
+                if predicted:
+                    accepted += 1
+                    correct += predicted == intent
+        return {
+            "samples": len(samples),
+            "coverage": round(accepted / len(samples), 3),
+            "precision": round(correct / accepted, 3) if accepted else None,
+            "mean_delay_ms": round(delay / len(samples), 2),
+        }
+
+    def stats(self):
+        """
+        Returns how many utterances were classified locally and the mean delay.
+
+        Returns:
+        - stats (dict): The local and deferred counts, the local share and the mean delay in ms.
+        """
+        with self._lock:
+            total = self.local + self.deferred
+            return {
+                "local": self.local,
+                "deferred": self.deferred,
+                "local_ratio": round(self.local / total, 3) if total else 0.0,
+                "mean_delay_ms": round(self.delay_ms / total, 2) if total else 0.0,
+            }
+
+
+class PhraseMatcher:
+    """
+    Finds the phrases of several categories in an utterance with one precompiled regular expression.
+
+    Utterances and phrases are normalized the same way. Phrases of word characters match only
+    whole words, so "German" does not match "man", while phrases in scripts written without
+    spaces, such as "写真", match anywhere. Categories marked exact match only the whole
+    utterance, with a dictionary lookup.
+    """
+    def __init__(self, categories, exact=()):
+        """
+        Parameters:
+        - categories (dict): Category name to a dict of phrase to value, or to a list of phrases,
+          the value of a listed phrase is the phrase itself.
+        - exact (iterable): The categories that must match the whole utterance.
+        """
+        self.categories = list(categories)
+        self._exact = collections.defaultdict(list)
+        self._phrases = collections.defaultdict(list)
+        for category, phrases in categories.items():
+            if not isinstance(phrases, dict):
+                phrases = {phrase: phrase for phrase in phrases}
+            table = self._exact if category in exact else self._phrases
+            for phrase, value in phrases.items():
+                table[normalize(phrase)].append((category, phrase, value))
+
+        alternatives = []
+        # longest first, so "look upper left" wins over a shorter phrase at the same position
+        for phrase in sorted(self._phrases, key=len, reverse=True):
+            escaped = re.escape(phrase)
+            if re.fullmatch(r"[a-z0-9' ]+", phrase):
+                escaped = r"(?<![\w'])" + escaped + r"(?![\w'])"
+            alternatives.append(escaped)
+        # the lookahead finds a match at every position, so overlapping phrases are all found
+        self._pattern = re.compile("(?=(" + "|".join(alternatives) + "))") if alternatives else None
+
+    def match(self, text):
+        """
+        Finds all phrases of all categories in a text.
+
+        Parameters:
+        - text (str): The utterance.
+
+        Returns:
+        - matches (dict): Category name to a list of (phrase, value) pairs in the order they appear,
+          categories without a match are left out.
+        """
+        matches = {}
+        if not text:
+            return matches
+        normalized = normalize(text)
+        found = list(self._exact.get(normalized, ()))
+        if self._pattern is not None:
+            for match in self._pattern.finditer(normalized):
+                found.extend(self._phrases[match.group(1)])
+        for category, phrase, value in found:
+            pairs = matches.setdefault(category, [])
+            if (phrase, value) not in pairs:
+                pairs.append((phrase, value))
+        return matches
+
+
+class IntentCache:
+    """
+    LRU cache of intents keyed by the normalized utterance, with the filler words removed, so
+    "Dance, please!" and "dance" share an entry. Entries expire after a time to live, and the
+    cache is written to a json file after each change so it survives restarts.
+    """
+    def __init__(self, path=INTENT_CACHE_PATH, max_entries=INTENT_CACHE_MAX_ENTRIES, ttl=INTENT_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    @staticmethod
+    def make_key(text):
+        """
+        Builds the cache key.
+
+        Parameters:
+        - text (str): The utterance.
+
+        Returns:
+        - key (str): The normalized utterance without filler words, or the normalized utterance if
+          it has only filler words.
+        """
+        normalized = normalize(text)
+        return strip_fillers(normalized) or normalized
+
+    def load(self):
+        """
+        Reads the cache file, expired entries are skipped.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"intent cache read error: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            # the file is written least recently used first
+            for key, (intent, confidence, timestamp) in entries:
+                if now - timestamp < self.ttl:
+                    self._entries[key] = (intent, confidence, timestamp)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        logging.debug(f"intent cache loaded {len(self._entries)} entries")
+
+    def _save(self):
+        if not self.path:
+            return
+        with self._lock:
+            entries = [[key, list(value)] for key, value in self._entries.items()]
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error(f"intent cache write error: {e}")
+
+    def get(self, text):
+        """
+        Looks up the intent of an utterance.
+
+        Parameters:
+        - text (str): The utterance.
+
+        Returns:
+        - result (tuple): (intent, confidence), or None if not cached or expired.
+        """
+        key = self.make_key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[2] >= self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return entry[0], entry[1]
+
+    def put(self, text, intent, confidence):
+        """
+        Stores the intent of an utterance and writes the cache file.
+
+        Parameters:
+        - text (str): The utterance.
+        - intent (str): The intent.
+        - confidence (str): The confidence of the intent.
+        """
+        key = self.make_key(text)
+        if not key:
+            return
+        with self._lock:
+            self._entries[key] = (intent, confidence, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self._save()
+
+    def forget(self, text):
+        """
+        Removes the cached intent of an utterance, such as to correct a wrong cloud label.
+
+        Parameters:
+        - text (str): The utterance.
+
+        Returns:
+        - removed (bool): True if the utterance was cached.
+        """
+        with self._lock:
+            removed = self._entries.pop(self.make_key(text), None) is not None
+        if removed:
+            self._save()
+        return removed
+
+    def stats(self):
+        """
+        Returns the cache hits, misses and size.
+
+        Returns:
+        - stats (dict): The hits, misses, hit ratio and entries.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(funcName)s:%(lineno)d] - %(message)s',
+        level=logging.DEBUG
+    )
+    classifier = LocalIntentClassifier(INTENT_EXAMPLES)
+    while True:
+        user_input = input("Enter function apis -- 'try'/'eval'/'forget' or 'exit' to quit: ").strip().lower()
+        if user_input == 'exit':
+            logging.info("Exit!")
+            break
+        elif user_input == 'try':
+            text = input("Sentence: ")
+            logging.info(f"intent: {classifier.classify(text)}, scores: {classifier.scores(text)[:3]}")
+        elif user_input == 'eval':
+            logging.info(f"evaluation on the logged utterances: {classifier.evaluate()}")
+        elif user_input == 'forget':
+            text = input("Sentence: ")
+            classifier.forget(text)
+            logging.info(f"removed from the intent cache: {IntentCache().forget(text)}")
+        else:
+            logging.info("Invalid command. Please enter 'try', 'eval', 'forget' or 'exit'.")
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ input_text_queue = queue.Queue()
 
 
 #gemini response text into this queue, and tts get text froom this queue
+#streamed responses are put as (sentence, final) tuples, ("", True) ends the stream
 output_text_queue = queue.Queue()
 
 
@@ -13,7 +14,7 @@ output_text_queue = queue.Queue()
 gif_queue = queue.Queue()
 
 
-#image show, input PIL image
+#image show, input PIL image or cartoon asset name: "hello.png", the display compositor keeps only the latest one
 image_queue = queue.Queue()
 
 
@@ -0,0 +1,51 @@
+#
+# Copyright 2024 MangDang (www.mangdang.net)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Description: Tests of the on-device intent classifier routing.
+#
+# Test Method: Run 'python -m pytest test_intent_classifier.py' in the ai-app folder.
+#
+
+import pytest
+
+from intent_classifier import LocalIntentClassifier, INTENT_EXAMPLES
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return LocalIntentClassifier(INTENT_EXAMPLES, log_path=None)
+
+
+@pytest.mark.parametrize("text", ["play", "game", "smile", "camera", "sleep", "questions", "smile please"])
+def test_single_words_are_left_to_the_cloud(classifier, text):
+    assert classifier.predict(text)[0] is None
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("move forwards", "movement_forward"),
+    ("move backwards", "movement_backward"),
+    ("move left", "movement_left"),
+    ("look up", "head_up"),
+    ("shut up", "system_sleep"),
+    ("speak please", "system_wake"),
+    ("sit down please", "posture_sit"),
+    ("take a photo", "photo"),
+])
+def test_command_phrases_are_classified_locally(classifier, text, intent):
+    assert classifier.predict(text) == (intent, 1.0)
+
+
+def test_unknown_words_are_left_to_the_cloud(classifier):
+    assert classifier.predict("look up the weather")[0] is None
@@ -0,0 +1,870 @@
+#
+# Copyright 2024 MangDang (www.mangdang.net)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Description: This Python script provides local audio processing for the microphone input before it is sent
+# to the cloud speech-to-text service, such as voice activity detection.
+#
+# Voice Activity Detection Test Method: Type 'vad', then press enter. Speak and stay silent, the speech start
+# and the suppressed audio are printed, press Ctrl+C to stop.
+# Resampling Benchmark Test Method: Type 'bench', then press enter.
+# Wake Phrase Enroll Test Method: Type 'enroll', then press enter. Type the phrase name, then say the phrase
+# each time you are asked.
+# Wake Phrase Spotting Test Method: Type 'spot', then press enter. Say a phrase, the best match and its
+# distance are printed, press Ctrl+C to stop.
+#
+
+import logging
+import collections
+import json
+import math
+import os
+import time
+import threading
+import numpy as np
+
+# microphone input format
+MIC_RATE = 48000
+MIC_CHANNELS = 2
+MIC_CHUNK = int(MIC_RATE / 10)
+
+# audio format sent to the cloud speech-to-text service, a speech model needs no more than 16 kHz mono
+STT_RATE = 16000
+STT_CHANNELS = 1
+
+# always-on microphone ring buffer: seconds kept, and audio from before a stt session starts that it reads
+MIC_RING_SECONDS = 10
+STT_PRE_ROLL = 0.2
+
+# on-device wake phrase spotting: where the enrolled samples are kept, and the longest phrase listened to
+WAKE_TEMPLATE_DIR = os.path.expanduser("~/.local/share/apps-md-robots/wake")
+WAKE_MAX_SECONDS = 2.5
+WAKE_ENROLL_SAMPLES = 3
+
+# recent utterances whose endpoint delays are kept for the stats
+ENDPOINT_STATS_UTTERANCES = 200
+
+
+class MicrophoneRing:
+    """
+    Captures the microphone continuously on one thread into a ring buffer of timestamped chunks.
+
+    Speech-to-text sessions read from a MicCursor instead of opening their own stream, so no
+    audio is lost to stream open and close between turns, and a session can start a little
+    in the past to catch the first syllables.
+    """
+    def __init__(self, py_audio, rate=MIC_RATE, channels=MIC_CHANNELS, chunk=MIC_CHUNK, seconds=MIC_RING_SECONDS):
+        self._py_audio = py_audio
+        self.rate = rate
+        self.channels = channels
+        self.chunk = chunk
+        self._chunks = collections.deque(maxlen=max(1, int(seconds * rate / chunk)))
+        self._first_seq = 0
+        self._next_seq = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.overruns = 0
+
+    def start(self):
+        """
+        Starts the capture thread.
+        """
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the capture thread, cursors waiting for audio get the end of stream.
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _open_stream(self):
+        import pyaudio
+        return self._py_audio.open(format=pyaudio.paInt16, channels=self.channels, rate=self.rate,
+                                   input=True, frames_per_buffer=self.chunk)
+
+    def _capture_loop(self):
+        stream = None
+        while self._running:
+            try:
+                if stream is None:
+                    stream = self._open_stream()
+                    logging.debug("microphone capture start")
+                data = stream.read(self.chunk, exception_on_overflow=False)
+            except Exception as e:
+                logging.error(f"microphone capture error: {e}")
+                if stream is not None:
+                    try:
+                        stream.close()
+                    except Exception:
+                        pass
+                    stream = None
+                time.sleep(0.5)
+                continue
+            timestamp = time.monotonic()
+            with self._cond:
+                if len(self._chunks) == self._chunks.maxlen:
+                    self._first_seq += 1
+                self._chunks.append((timestamp, data))
+                self._next_seq += 1
+                self._cond.notify_all()
+        if stream is not None:
+            stream.stop_stream()
+            stream.close()
+        logging.debug("microphone capture stop")
+
+    def cursor(self, pre_roll=STT_PRE_ROLL):
+        """
+        Returns a cursor that reads from shortly before now.
+
+        Parameters:
+        - pre_roll (float): The seconds of already captured audio to start with.
+
+        Returns:
+        - cursor (MicCursor): The cursor, read it like a PyAudio stream.
+        """
+        since = time.monotonic() - pre_roll
+        with self._cond:
+            seq = self._next_seq
+            for timestamp, _ in reversed(self._chunks):
+                if timestamp < since:
+                    break
+                seq -= 1
+        return MicCursor(self, seq)
+
+    def _read(self, cursor):
+        with self._cond:
+            while cursor.seq >= self._next_seq:
+                if cursor.closed or not self._running:
+                    return b""
+                self._cond.wait()
+            if cursor.closed:
+                return b""
+            if cursor.seq < self._first_seq:
+                # the reader fell behind further than the ring holds
+                self.overruns += self._first_seq - cursor.seq
+                cursor.seq = self._first_seq
+            _, data = self._chunks[cursor.seq - self._first_seq]
+            cursor.seq += 1
+            return data
+
+    def _close(self, cursor):
+        with self._cond:
+            cursor.closed = True
+            self._cond.notify_all()
+
+
+class MicCursor:
+    """
+    Reads microphone chunks from a MicrophoneRing, with the PyAudio stream methods used by
+    the speech-to-text functions. Closing it never touches the audio device.
+    """
+    def __init__(self, ring, seq):
+        self._ring = ring
+        self.seq = seq
+        self.closed = False
+
+    def read(self, num_frames=None, exception_on_overflow=False):
+        """
+        Returns the next chunk, blocking until it is captured, or b"" once closed.
+        The ring chunk size is always used, num_frames is only for PyAudio compatibility.
+        """
+        return self._ring._read(self)
+
+    def stop_stream(self):
+        self._ring._close(self)
+
+    def close(self):
+        self._ring._close(self)
+
+
+class VoiceActivityDetector:
+    """
+    Detects speech in 16 bit PCM chunks from the energy and the zero-crossing rate.
+
+    The noise floor adapts to the room on non-speech chunks, a chunk is speech when its energy
+    is well above the floor and its zero-crossing rate is not noise-like. The most recent chunks
+    are kept as pre-roll so the start of the first word is not lost.
+    """
+    def __init__(self, rate=MIC_RATE, channels=MIC_CHANNELS, threshold_db=10.0, min_energy_db=-60.0,
+                 max_zcr=0.45, pre_roll=0.3, hangover=0.5, noise_adapt=0.05):
+        self.rate = rate
+        self.channels = channels
+        self.threshold_db = threshold_db
+        self.min_energy_db = min_energy_db
+        self.max_zcr = max_zcr
+        self.pre_roll = pre_roll
+        self.hangover = hangover
+        self.noise_adapt = noise_adapt
+        self.noise_floor_db = None
+        self._hangover_left = 0.0
+        self.total_seconds = 0.0
+        self.speech_seconds = 0.0
+        self.suppressed_seconds = 0.0
+        self.suppressed_bytes = 0
+        self.triggers = 0
+
+    def _features(self, chunk):
+        samples = np.frombuffer(chunk, dtype=np.int16).astype(np.float32)
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis=1)
+        if samples.size == 0:
+            return self.min_energy_db - 1, 0.0, 0.0
+        rms = np.sqrt(np.mean(samples * samples))
+        energy_db = 20 * np.log10(rms / 32768 + 1e-10)
+        signs = np.signbit(samples)
+        zcr = np.count_nonzero(signs[1:] != signs[:-1]) / samples.size
+        return float(energy_db), float(zcr), samples.size / self.rate
+
+    def process(self, chunk):
+        """
+        Classifies one chunk and updates the noise floor.
+
+        Parameters:
+        - chunk (bytes): The interleaved 16 bit PCM chunk.
+
+        Returns:
+        - is_speech (bool): True if the chunk is speech, including the hangover after speech.
+        """
+        energy_db, zcr, seconds = self._features(chunk)
+        self.total_seconds += seconds
+        if self.noise_floor_db is None:
+            self.noise_floor_db = energy_db
+
+        speech = (energy_db > self.noise_floor_db + self.threshold_db
+                  and energy_db > self.min_energy_db
+                  and zcr < self.max_zcr)
+        if speech:
+            self._hangover_left = self.hangover
+            # creep up during long loud stretches so a steady new noise stops counting as speech
+            self.noise_floor_db += self.noise_adapt * 0.1 * (energy_db - self.noise_floor_db)
+        else:
+            # follow a quieter room at once, a louder one slowly
+            if energy_db < self.noise_floor_db:
+                self.noise_floor_db = energy_db
+            else:
+                self.noise_floor_db += self.noise_adapt * (energy_db - self.noise_floor_db)
+            if self._hangover_left > 1e-6:
+                self._hangover_left -= seconds
+                speech = True
+
+        if speech:
+            self.speech_seconds += seconds
+        return speech
+
+    def wait_for_speech(self, read_chunk):
+        """
+        Reads chunks until speech starts.
+
+        Parameters:
+        - read_chunk (callable): Returns the next chunk, or empty bytes/None at the end of the stream.
+
+        Returns:
+        - chunks (list): The pre-roll chunks followed by the chunk where speech started,
+          or an empty list if the stream ended first.
+        """
+        pre_roll = collections.deque()
+        pre_roll_seconds = 0.0
+        while True:
+            chunk = read_chunk()
+            if not chunk:
+                for dropped in pre_roll:
+                    self._suppress(dropped)
+                return []
+            pre_roll.append(chunk)
+            pre_roll_seconds += self._seconds(chunk)
+            while len(pre_roll) > 1 and pre_roll_seconds - self._seconds(pre_roll[0]) >= self.pre_roll:
+                dropped = pre_roll.popleft()
+                pre_roll_seconds -= self._seconds(dropped)
+                self._suppress(dropped)
+            if self.process(chunk):
+                self.triggers += 1
+                logging.debug(f"speech start, noise floor {self.noise_floor_db:.1f}dB")
+                return list(pre_roll)
+
+    def _seconds(self, chunk):
+        return len(chunk) / (2 * self.channels * self.rate)
+
+    def _suppress(self, chunk):
+        self.suppressed_seconds += self._seconds(chunk)
+        self.suppressed_bytes += len(chunk)
+
+    def reset(self):
+        """
+        Forgets the current speech state, the noise floor and the statistics are kept.
+        """
+        self._hangover_left = 0.0
+
+    def stats(self):
+        """
+        Returns how much audio was processed and how much was kept from the cloud.
+
+        Returns:
+        - stats (dict): The seconds processed, speech and suppressed, suppressed bytes and the noise floor.
+        """
+        return {
+            "total_seconds": round(self.total_seconds, 1),
+            "speech_seconds": round(self.speech_seconds, 1),
+            "suppressed_seconds": round(self.suppressed_seconds, 1),
+            "suppressed_ratio": round(self.suppressed_seconds / self.total_seconds, 3) if self.total_seconds else 0.0,
+            "suppressed_bytes": self.suppressed_bytes,
+            "triggers": self.triggers,
+            "noise_floor_db": round(self.noise_floor_db, 1) if self.noise_floor_db is not None else None,
+        }
+
+
+class Endpointer:
+    """
+    Decides locally that the user has finished speaking, before the server marks a result final.
+
+    The end of an utterance is a run of trailing silence from the voice activity detector while
+    the interim transcript has stopped changing. A long enough silence ends the utterance even if
+    the transcript still changes. The times of the local and the server endpoints are recorded so
+    they can be compared.
+    """
+    def __init__(self, vad, trailing_silence=0.3, stable_interim=0.4, max_silence=1.2,
+                 stats_utterances=ENDPOINT_STATS_UTTERANCES):
+        self.vad = vad
+        self.trailing_silence = trailing_silence
+        self.stable_interim = stable_interim
+        self.max_silence = max_silence
+        self._lock = threading.Lock()
+        self.local_delays = collections.deque(maxlen=stats_utterances)
+        self.server_delays = collections.deque(maxlen=stats_utterances)
+        self.local_endpoints = 0
+        self.server_endpoints = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Starts a new utterance, the statistics are kept.
+        """
+        with self._lock:
+            self._silence = 0.0
+            self._transcript = ""
+            self._transcript_time = None
+            self._speech_end_time = None
+            self.local_time = None
+            self.server_time = None
+
+    def process(self, chunk):
+        """
+        Classifies one chunk after speech started.
+
+        Parameters:
+        - chunk (bytes): The 16 bit PCM chunk, in the format of the voice activity detector.
+
+        Returns:
+        - ended (bool): True once the utterance has ended locally.
+        """
+        speech = self.vad.process(chunk)
+        now = time.monotonic()
+        with self._lock:
+            if self.local_time is not None:
+                return True
+            if speech:
+                self._silence = 0.0
+                self._speech_end_time = None
+                return False
+            if self._speech_end_time is None:
+                self._speech_end_time = now
+            self._silence += self.vad._seconds(chunk)
+            if not self._transcript or self._silence < self.trailing_silence:
+                return False
+            stable = now - self._transcript_time >= self.stable_interim
+            if stable or self._silence >= self.max_silence:
+                self.local_time = now
+                self.local_endpoints += 1
+                self.local_delays.append(now - self._speech_end_time)
+                logging.debug(f"local endpoint after {self._silence:.2f}s silence, stable transcript: {stable}")
+                return True
+        return False
+
+    def on_interim(self, transcript):
+        """
+        Records an interim transcript from the server.
+
+        Parameters:
+        - transcript (str): The interim transcript.
+        """
+        with self._lock:
+            if transcript != self._transcript:
+                self._transcript = transcript
+                self._transcript_time = time.monotonic()
+
+    def on_final(self):
+        """
+        Records that the server marked a result final.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.server_time is not None:
+                return
+            self.server_time = now
+            if self.local_time is None:
+                self.server_endpoints += 1
+            if self._speech_end_time is not None:
+                self.server_delays.append(now - self._speech_end_time)
+
+    @property
+    def transcript(self):
+        """
+        The last interim transcript, used when the server returns no final result.
+        """
+        with self._lock:
+            return self._transcript
+
+    def stats(self):
+        """
+        Returns how the local and the server endpoints compare.
+
+        Returns:
+        - stats (dict): The count of utterances ended locally and by the server first, and the mean
+          seconds from the end of speech to the local endpoint and to the server final result over
+          the last ENDPOINT_STATS_UTTERANCES utterances.
+        """
+        with self._lock:
+            return {
+                "local_endpoints": self.local_endpoints,
+                "server_endpoints": self.server_endpoints,
+                "local_delay": round(float(np.mean(self.local_delays)), 3) if self.local_delays else None,
+                "server_delay": round(float(np.mean(self.server_delays)), 3) if self.server_delays else None,
+            }
+
+
+def _mel_filterbank(rate, n_fft, n_mels):
+    def hz_to_mel(hz):
+        return 2595 * np.log10(1 + hz / 700)
+
+    def mel_to_hz(mel):
+        return 700 * (10 ** (mel / 2595) - 1)
+
+    mels = np.linspace(hz_to_mel(0), hz_to_mel(rate / 2), n_mels + 2)
+    bins = np.floor((n_fft + 1) * mel_to_hz(mels) / rate).astype(int)
+    bank = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for i in range(n_mels):
+        left, center, right = bins[i], bins[i + 1], bins[i + 2]
+        if center > left:
+            bank[i, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            bank[i, center:right] = (right - np.arange(center, right)) / (right - center)
+    return bank
+
+
+def mfcc(samples, rate=STT_RATE, n_mfcc=13, n_mels=26, frame_seconds=0.025, hop_seconds=0.01):
+    """
+    Computes mel-frequency cepstral coefficients with mean normalization.
+
+    Parameters:
+    - samples (np.ndarray): The mono samples.
+    - rate (int): The sample rate.
+    - n_mfcc (int): The coefficients per frame.
+    - n_mels (int): The mel filters.
+    - frame_seconds (float): The frame length.
+    - hop_seconds (float): The step between frames.
+
+    Returns:
+    - features (np.ndarray): The features, one row of n_mfcc per frame.
+    """
+    frame = int(rate * frame_seconds)
+    hop = int(rate * hop_seconds)
+    samples = np.asarray(samples, dtype=np.float32)
+    samples = np.append(samples[:1], samples[1:] - 0.97 * samples[:-1])
+    if samples.size < frame:
+        samples = np.pad(samples, (0, frame - samples.size))
+    count = 1 + (samples.size - frame) // hop
+    index = np.arange(frame)[None, :] + hop * np.arange(count)[:, None]
+    n_fft = 1 << (frame - 1).bit_length()
+    frames = samples[index] * np.hamming(frame).astype(np.float32)
+    power = np.abs(np.fft.rfft(frames, n_fft)) ** 2 / n_fft
+    energies = np.log(power @ _mel_filterbank(rate, n_fft, n_mels).T + 1e-10)
+    k = np.arange(n_mels)
+    dct = np.cos(np.pi / n_mels * (k[None, :] + 0.5) * np.arange(n_mfcc)[:, None])
+    features = energies @ dct.T
+    return features - features.mean(axis=0)
+
+
+def dtw_distance(a, b):
+    """
+    Aligns two feature sequences with dynamic time warping.
+
+    Parameters:
+    - a (np.ndarray): The first sequence, one row per frame.
+    - b (np.ndarray): The second sequence, one row per frame.
+
+    Returns:
+    - distance (float): The cost of the best alignment divided by the length of both sequences.
+    """
+    cost = np.sqrt(((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2))
+    n, m = cost.shape
+    total = np.full((n + 1, m + 1), np.inf)
+    total[0, 0] = 0.0
+    for i in range(1, n + 1):
+        above = total[i - 1]
+        step_cost = cost[i - 1]
+        # steps from above and from the diagonal only need the previous row
+        from_above = (np.minimum(above[:-1], above[1:]) + step_cost).tolist()
+        # the step from the left needs the previous cell of the same row
+        left = math.inf
+        row = total[i]
+        for j, step in enumerate(step_cost.tolist()):
+            left = min(from_above[j], left + step)
+            row[j + 1] = left
+    return float(total[n, m] / (n + m))
+
+
+class KeywordSpotter:
+    """
+    Spots enrolled wake phrases on the device, so the cloud speech-to-text is not used while asleep.
+
+    Each phrase is enrolled from a few spoken samples, stored as MFCC templates. An utterance
+    matches a phrase when its dynamic time warping distance to the closest template is within the
+    phrase threshold, derived from how far the enrolled samples are from each other.
+    """
+    def __init__(self, template_dir=WAKE_TEMPLATE_DIR, rate=STT_RATE, channels=STT_CHANNELS,
+                 margin=1.5, default_threshold=12.0):
+        self.template_dir = template_dir
+        self.rate = rate
+        self.channels = channels
+        self.margin = margin
+        self.default_threshold = default_threshold
+        self.templates = {}
+        self.thresholds = {}
+        self.load()
+
+    def load(self):
+        """
+        Loads the enrolled templates from the template directory.
+        """
+        self.templates = {}
+        self.thresholds = {}
+        if not os.path.isdir(self.template_dir):
+            return
+        try:
+            with open(os.path.join(self.template_dir, "thresholds.json")) as f:
+                self.thresholds = json.load(f)
+        except (OSError, ValueError):
+            self.thresholds = {}
+        for name in sorted(os.listdir(self.template_dir)):
+            if not name.endswith(".npy"):
+                continue
+            phrase = name.rsplit("-", 1)[0]
+            try:
+                self.templates.setdefault(phrase, []).append(np.load(os.path.join(self.template_dir, name)))
+            except (OSError, ValueError) as e:
+                logging.error(f"wake template {name} load error: {e}")
+        logging.debug(f"wake phrases loaded: {list(self.templates)}")
+
+    def has_templates(self):
+        """
+        Returns True if at least one wake phrase is enrolled.
+        """
+        return bool(self.templates)
+
+    def features(self, audio):
+        """
+        Returns the MFCC features of 16 bit PCM audio.
+
+        Parameters:
+        - audio (bytes): The interleaved 16 bit PCM audio.
+
+        Returns:
+        - features (np.ndarray): The features, one row per frame.
+        """
+        samples = np.frombuffer(audio, dtype=np.int16).astype(np.float32) / 32768
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis=1)
+        return mfcc(samples, self.rate)
+
+    def enroll(self, phrase, samples):
+        """
+        Stores the templates of a wake phrase, replacing any enrolled before.
+
+        Parameters:
+        - phrase (str): The phrase name, such as "hello_robot".
+        - samples (list): The spoken samples, each 16 bit PCM audio bytes.
+        """
+        os.makedirs(self.template_dir, exist_ok=True)
+        for name in os.listdir(self.template_dir):
+            if name.endswith(".npy") and name.rsplit("-", 1)[0] == phrase:
+                os.remove(os.path.join(self.template_dir, name))
+        templates = [self.features(sample) for sample in samples]
+        for i, template in enumerate(templates):
+            np.save(os.path.join(self.template_dir, f"{phrase}-{i}.npy"), template)
+
+        distances = [dtw_distance(a, b) for i, a in enumerate(templates) for b in templates[i + 1:]]
+        if distances:
+            self.thresholds[phrase] = float(max(distances) * self.margin)
+        else:
+            self.thresholds.pop(phrase, None)
+        with open(os.path.join(self.template_dir, "thresholds.json"), "w") as f:
+            json.dump(self.thresholds, f)
+        self.templates[phrase] = templates
+        logging.info(f"wake phrase {phrase} enrolled from {len(templates)} samples, "
+                     f"threshold {self.thresholds.get(phrase, self.default_threshold):.1f}")
+
+    def match(self, audio):
+        """
+        Finds the enrolled phrase closest to an utterance.
+
+        Parameters:
+        - audio (bytes): The utterance as 16 bit PCM audio.
+
+        Returns:
+        - phrase (str): The matching phrase, or None if no phrase is within its threshold.
+        - distance (float): The distance to the closest template.
+        """
+        features = self.features(audio)
+        best_phrase, best_distance = None, math.inf
+        for phrase, templates in self.templates.items():
+            distance = min(dtw_distance(features, template) for template in templates)
+            if distance <= self.thresholds.get(phrase, self.default_threshold) and distance < best_distance:
+                best_phrase, best_distance = phrase, distance
+            elif best_phrase is None:
+                best_distance = min(best_distance, distance)
+        return best_phrase, best_distance
+
+    def record(self, read_chunk, vad, max_seconds=WAKE_MAX_SECONDS):
+        """
+        Records one utterance, from the start of speech until the voice activity detector hears silence.
+
+        Parameters:
+        - read_chunk (callable): Returns the next chunk, or empty bytes/None at the end of the stream.
+        - vad (VoiceActivityDetector): The detector, in the same audio format as the spotter.
+        - max_seconds (float): The longest utterance kept.
+
+        Returns:
+        - audio (bytes): The utterance, or empty bytes if the stream ended before speech.
+        """
+        vad.reset()
+        chunks = vad.wait_for_speech(read_chunk)
+        if not chunks:
+            return b""
+        max_bytes = int(max_seconds * self.rate) * 2 * self.channels
+        size = sum(len(chunk) for chunk in chunks)
+        while size < max_bytes:
+            chunk = read_chunk()
+            if not chunk or not vad.process(chunk):
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        return b"".join(chunks)[:max_bytes]
+
+    def listen(self, read_chunk, vad):
+        """
+        Records one utterance and matches it against the enrolled phrases.
+
+        Parameters:
+        - read_chunk (callable): Returns the next chunk, or empty bytes/None at the end of the stream.
+        - vad (VoiceActivityDetector): The detector, in the same audio format as the spotter.
+
+        Returns:
+        - phrase (str): The matching phrase, or None.
+        """
+        audio = self.record(read_chunk, vad)
+        if not audio:
+            return None
+        start = time.perf_counter()
+        phrase, distance = self.match(audio)
+        logging.debug(f"wake spotting: {phrase}, distance {distance:.1f}, "
+                      f"{(time.perf_counter() - start) * 1000:.0f}ms")
+        return phrase
+
+
+class Resampler:
+    """
+    Downmixes interleaved 16 bit PCM to mono and resamples it with a polyphase FIR filter.
+
+    The filter state is carried between chunks so the output is continuous, and the work
+    buffers are allocated once and only grow if a larger chunk arrives.
+    """
+    def __init__(self, in_rate=MIC_RATE, out_rate=STT_RATE, channels=MIC_CHANNELS, taps_per_phase=32):
+        divisor = math.gcd(in_rate, out_rate)
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.channels = channels
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+
+        # windowed-sinc low-pass at the lower nyquist rate, designed at the upsampled rate
+        num_taps = taps_per_phase * self.up
+        cutoff = 0.45 / max(self.up, self.down)
+        n = np.arange(num_taps) - (num_taps - 1) / 2
+        h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(num_taps, 8.0)
+        h *= self.up / h.sum()
+        # phase p holds h[p], h[p + up], ..., reversed to line up with the input windows
+        self._phases = np.ascontiguousarray(h.reshape(taps_per_phase, self.up).T[:, ::-1], dtype=np.float32)
+        self._taps = taps_per_phase
+
+        self._next = 0
+        self._buffer = np.zeros(self._taps - 1 + MIC_CHUNK, dtype=np.float32)
+        self._out = np.zeros(MIC_CHUNK, dtype=np.int16)
+
+    def process(self, chunk):
+        """
+        Converts one chunk.
+
+        Parameters:
+        - chunk (bytes): The interleaved 16 bit PCM chunk at the input rate.
+
+        Returns:
+        - chunk (bytes): The mono 16 bit PCM chunk at the output rate.
+        """
+        samples = np.frombuffer(chunk, dtype=np.int16).reshape(-1, self.channels)
+        count = samples.shape[0]
+        history = self._taps - 1
+        if self._buffer.size < history + count:
+            buffer = np.zeros(history + count, dtype=np.float32)
+            buffer[:history] = self._buffer[:history]
+            self._buffer = buffer
+        x = self._buffer[:history + count]
+        view = x[history:]
+        samples.sum(axis=1, dtype=np.float32, out=view)
+        if self.channels > 1:
+            view *= 1.0 / self.channels
+
+        outputs = max(0, -(-(count * self.up - self._next) // self.down))
+        positions = self._next + np.arange(outputs) * self.down
+        phases = positions % self.up
+        starts = positions // self.up
+        windows = np.lib.stride_tricks.sliding_window_view(x, self._taps)[starts]
+        if self.up == 1:
+            y = windows @ self._phases[0]
+        else:
+            y = np.einsum("ij,ij->i", windows, self._phases[phases])
+
+        if self._out.size < outputs:
+            self._out = np.zeros(outputs, dtype=np.int16)
+        out = self._out[:outputs]
+        np.clip(y, -32768, 32767, out=y)
+        out[...] = y
+
+        self._next += outputs * self.down - count * self.up
+        x[:history] = x[count:count + history]
+        return out.tobytes()
+
+    def reset(self):
+        """
+        Clears the filter state before a new stream.
+        """
+        self._next = 0
+        self._buffer[:] = 0
+
+
+def benchmark_resampler(seconds=10, in_rate=MIC_RATE, out_rate=STT_RATE, channels=MIC_CHANNELS):
+    """
+    Measures the CPU cost of the downmix and resample stage against the uplink it saves.
+
+    Parameters:
+    - seconds (int): The seconds of audio to process.
+    - in_rate (int): The microphone rate.
+    - out_rate (int): The speech-to-text rate.
+    - channels (int): The microphone channels.
+
+    Returns:
+    - results (dict): The CPU milliseconds per audio second, the bytes in and out and the uplink saving.
+    """
+    resampler = Resampler(in_rate, out_rate, channels)
+    chunk_frames = int(in_rate / 10)
+    rng = np.random.default_rng(0)
+    chunks = [rng.integers(-3000, 3000, chunk_frames * channels, dtype=np.int16).tobytes()
+              for _ in range(10)]
+    bytes_in = 0
+    bytes_out = 0
+    cpu_start = time.process_time()
+    for i in range(seconds * 10):
+        chunk = chunks[i % len(chunks)]
+        bytes_in += len(chunk)
+        bytes_out += len(resampler.process(chunk))
+    cpu_ms = (time.process_time() - cpu_start) * 1000
+    return {
+        "cpu_ms_per_second": round(cpu_ms / seconds, 3),
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "uplink_saving": round(1 - bytes_out / bytes_in, 3),
+    }
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(funcName)s:%(lineno)d] - %(message)s',
+        level=logging.DEBUG
+    )
+    import pyaudio
+
+    py_audio = pyaudio.PyAudio()
+    while True:
+        user_input = input("Enter function apis -- 'vad'/'enroll'/'spot'/'bench' or 'exit' to quit: ").strip().lower()
+        if user_input == 'exit':
+            logging.info("Exit!")
+            break
+        elif user_input == 'vad':
+            stream = py_audio.open(format=pyaudio.paInt16, channels=MIC_CHANNELS, rate=MIC_RATE,
+                                   input=True, frames_per_buffer=MIC_CHUNK)
+            vad = VoiceActivityDetector()
+            try:
+                while True:
+                    chunks = vad.wait_for_speech(lambda: stream.read(MIC_CHUNK))
+                    logging.info(f"speech start, {len(chunks)} chunks with pre-roll, stats: {vad.stats()}")
+                    while vad.process(stream.read(MIC_CHUNK)):
+                        pass
+                    logging.info("speech end")
+            except KeyboardInterrupt:
+                logging.info(f"vad stats: {vad.stats()}")
+            finally:
+                stream.stop_stream()
+                stream.close()
+        elif user_input in ('enroll', 'spot'):
+            mic = MicrophoneRing(py_audio)
+            mic.start()
+            cursor = mic.cursor(pre_roll=0)
+            resampler = Resampler()
+            vad = VoiceActivityDetector(rate=STT_RATE, channels=STT_CHANNELS)
+            spotter = KeywordSpotter()
+            read_chunk = lambda: resampler.process(cursor.read())
+            try:
+                if user_input == 'enroll':
+                    phrase = input("Phrase name, such as hello_robot: ").strip().lower().replace(" ", "_")
+                    samples = []
+                    while len(samples) < WAKE_ENROLL_SAMPLES:
+                        logging.info(f"say the phrase ({len(samples) + 1}/{WAKE_ENROLL_SAMPLES})")
+                        samples.append(spotter.record(read_chunk, vad))
+                    spotter.enroll(phrase, samples)
+                else:
+                    while True:
+                        audio = spotter.record(read_chunk, vad)
+                        logging.info(f"match: {spotter.match(audio)}")
+            except KeyboardInterrupt:
+                pass
+            finally:
+                cursor.close()
+                mic.stop()
+        elif user_input == 'bench':
+            logging.info(f"downmix and resample {MIC_RATE}Hz x{MIC_CHANNELS} to {STT_RATE}Hz x{STT_CHANNELS}: "
+                         f"{benchmark_resampler()}")
+        else:
+            logging.info("Invalid command. Please enter 'vad', 'enroll', 'spot', 'bench' or 'exit'.")
+
+if __name__ == '__main__':
+    main()
@@ -83,6 +83,9 @@ class AnimatedGif:
             )
             self._frames.append(frame_object)
  
+    def frames(self):
+        return [(frame_object.image, frame_object.duration) for frame_object in self._frames]
+
     def play(self):
         # Check if we have loaded any files first
         if not self._gif_files:
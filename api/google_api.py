@@ -17,6 +17,7 @@
 # speech recognition (speech-to-text), and speech synthesis (text-to-speech). It integrates Google Cloud services and other libraries to accomplish these tasks.
 #
 # Gemini Test Method: type 'text' followed by a ' ' (space), and the text you want to type, then press enter.
+# Gemini Streaming Test Method: type 'stream' followed by a ' ' (space), and the text you want to type, then press enter.
 # Gemini Visio Pro Test method: type 'image' followed by a ' ' (space), and the text you want to type, then press enter.
 # Speech-T-Text Test method: type 'text'. After pressing enter, start speaking, then press enter.
 # Text-To-Speech Test method: type 'text' followed by a ' ' (space), and the text you want to type, then press enter.
@@ -30,13 +31,21 @@ import logging
 import os
 import base64
 import time
+import re
+import threading
+import collections
+import queue
+import hashlib
+import itertools
+from typing import Any, Optional
 import numpy as np
 import google.auth
 from PIL import Image
 from vertexai.preview.generative_models import Image as VertexImage
 from langchain_google_vertexai import ChatVertexAI
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import HumanMessage, SystemMessage, get_buffer_string
 from langchain.memory import ConversationBufferMemory
+from pydantic import PrivateAttr
 from langchain.chains.conversation.base import ConversationChain
 from langchain.prompts import (
     ChatPromptTemplate,
@@ -51,12 +60,43 @@ from google.cloud import speech
 from google.cloud import texttospeech
 from io import BytesIO
 import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _turbojpeg = TurboJPEG()
+except Exception:
+    _turbojpeg = None
 
 # language code and name, default is en-US
 language_code = "en-US"
 language_name = "en-US-Standard-E"
 
+# image encoding for vision requests: longest edge in pixels, jpeg quality and size target in bytes
+image_long_edge = 640
+image_jpeg_quality = 85
+image_max_bytes = 64 * 1024
+IMAGE_MIN_JPEG_QUALITY = 40
+
+# synthesized speech cache, in memory and on disk
+TTS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "apps-md-robots", "tts")
+TTS_CACHE_MEMORY_BYTES = 32 * 1024 * 1024
+TTS_CACHE_DISK_BYTES = 256 * 1024 * 1024
+TTS_SAMPLE_RATE = 24000
+
+# audio output, the inner audio play device is "bcm2835 Headphones" on mini pupper
+AUDIO_OUTPUT_DEVICE = "headphone"
+AUDIO_CHUNK_FRAMES = 2400
+
+# concurrent per-sentence synthesis requests, they share the one client channel
+TTS_SYNTHESIS_WORKERS = 3
+
+# conversation history sent with each chat request, in approximate tokens, older turns are summarized
+CONVERSATION_MAX_TOKENS = 1024
+CONVERSATION_SUMMARY_WORDS = 80
+# recent turns whose prompt size is kept for the stats
+CONVERSATION_STATS_TURNS = 200
+
 def init_credentials(key_json_path):
     """
     Initializes Google Cloud credentials by setting the environment variable.
@@ -72,10 +112,139 @@ def init_credentials(key_json_path):
     credentials, project_id = google.auth.default()
     return credentials, project_id
 
-def create_conversation():
+def estimate_tokens(text):
+    """
+    Approximates the token count of a text, about four characters per token.
+
+    Parameters:
+    - text (str): The text.
+
+    Returns:
+    - tokens (int): The approximate token count.
+    """
+    return len(text) // 4 + 1
+
+
+class BoundedConversationMemory(ConversationBufferMemory):
+    """
+    Conversation memory that keeps the history sent with each request within a token budget.
+
+    The newest turns are kept word for word. When they exceed the budget, the oldest turns are
+    dropped from the window at once and folded into a rolling summary on a background thread,
+    so the request that follows does not wait for the summary. The summary is sent as a system
+    message ahead of the window.
+    """
+    max_tokens: int = CONVERSATION_MAX_TOKENS
+    summary_llm: Optional[Any] = None
+    summary: str = ""
+
+    _lock: object = PrivateAttr(default_factory=threading.Lock)
+    _pending: list = PrivateAttr(default_factory=list)
+    _summarizing: bool = PrivateAttr(default=False)
+    _prompt_tokens: collections.deque = PrivateAttr(
+        default_factory=lambda: collections.deque(maxlen=CONVERSATION_STATS_TURNS))
+    _turns: int = PrivateAttr(default=0)
+    _summaries: int = PrivateAttr(default=0)
+
+    def load_memory_variables(self, inputs):
+        with self._lock:
+            summary = self.summary
+            messages = list(self.chat_memory.messages)
+        if summary:
+            messages.insert(0, SystemMessage(content=f"Summary of the earlier conversation: {summary}"))
+        tokens = sum(estimate_tokens(message.content) for message in messages)
+        tokens += estimate_tokens(str(inputs.get("input", ""))) if inputs else 0
+        with self._lock:
+            self._prompt_tokens.append(tokens)
+            self._turns += 1
+        logging.debug(f"conversation prompt tokens: {tokens}, history messages: {len(messages)}")
+        if self.return_messages:
+            return {self.memory_key: messages}
+        return {self.memory_key: get_buffer_string(messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)}
+
+    def save_context(self, inputs, outputs):
+        super().save_context(inputs, outputs)
+        with self._lock:
+            messages = self.chat_memory.messages
+            pruned = []
+            # drop whole turns, but always keep the newest one
+            while len(messages) > 2 and sum(estimate_tokens(message.content) for message in messages) > self.max_tokens:
+                pruned.extend(messages[:2])
+                del messages[:2]
+            if not pruned:
+                return
+            self._pending.extend(pruned)
+            if self._summarizing or self.summary_llm is None:
+                if self.summary_llm is None:
+                    self._pending.clear()
+                return
+            self._summarizing = True
+        threading.Thread(target=self._summarize, daemon=True).start()
+
+    def _summarize(self):
+        while True:
+            with self._lock:
+                pruned = self._pending
+                self._pending = []
+                summary = self.summary
+                if not pruned:
+                    self._summarizing = False
+                    return
+            prompt = (f"Update the summary of a conversation between a user and a robot puppy with the new lines. "
+                      f"Keep names, facts and the user's preferences, use at most {CONVERSATION_SUMMARY_WORDS} words, "
+                      f"answer with the summary only.\n\nSummary: {summary}\n\nNew lines:\n"
+                      f"{get_buffer_string(pruned, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)}")
+            ms_start = int(time.time() * 1000)
+            try:
+                summary = self.summary_llm.invoke([HumanMessage(content=prompt)]).content.strip()
+            except Exception as e:
+                logging.error(f"conversation summary error: {e}")
+                with self._lock:
+                    self._summarizing = False
+                return
+            # a summary that ignores the word limit is cut so it cannot grow the prompt without bound
+            words = summary.split()
+            if len(words) > CONVERSATION_SUMMARY_WORDS * 2:
+                summary = " ".join(words[-CONVERSATION_SUMMARY_WORDS * 2:])
+            with self._lock:
+                self.summary = summary
+                self._summaries += 1
+            logging.debug(f"conversation summary updated, delay = {int(time.time() * 1000) - ms_start}ms: {summary}")
+
+    def clear(self):
+        super().clear()
+        with self._lock:
+            self.summary = ""
+            self._pending.clear()
+
+    def stats(self):
+        """
+        Returns the prompt size per turn, over the last CONVERSATION_STATS_TURNS turns.
+
+        Returns:
+        - stats (dict): The turns, the last, mean and largest approximate prompt tokens and the summaries made.
+        """
+        with self._lock:
+            tokens = list(self._prompt_tokens)
+            turns = self._turns
+            summaries = self._summaries
+        return {
+            "turns": turns,
+            "last_tokens": tokens[-1] if tokens else 0,
+            "mean_tokens": round(sum(tokens) / len(tokens), 1) if tokens else 0.0,
+            "max_tokens": max(tokens) if tokens else 0,
+            "summaries": summaries,
+        }
+
+
+def create_conversation(max_tokens=CONVERSATION_MAX_TOKENS):
     """
     Creates an instance of ConversationChain for AI interactions.
 
+    Parameters:
+    - max_tokens (int): The approximate token budget of the history sent with each request,
+      older turns are summarized. None keeps the whole history.
+
     Returns:
     - conversation (ConversationChain): The conversation object initialized with the AI model and prompt template.
     """
@@ -102,7 +271,11 @@ def create_conversation():
         ]
     )
 
-    memory = ConversationBufferMemory(memory_key="history", return_messages=True)
+    if max_tokens is None:
+        memory = ConversationBufferMemory(memory_key="history", return_messages=True)
+    else:
+        memory = BoundedConversationMemory(memory_key="history", return_messages=True,
+                                           max_tokens=max_tokens, summary_llm=model)
     conversation = ConversationChain(llm=model, prompt=prompt, verbose=False, memory=memory)
     logging.debug("conversation create end!")
     return conversation
@@ -130,14 +303,401 @@ def ai_text_response(conversation, input_text):
     logging.debug(f"ai_text_response end, delay = {ms_end - ms_start}ms")
     return result
 
-def ai_image_response(llm, image, text):
+# a sentence ends with . ! ? followed by a space, or with a CJK full stop
+SENTENCE_PATTERN = re.compile(r'.+?(?:[.!?]+(?=\s)|[。！？]+)', re.S)
+
+class SentenceSplitter:
+    """
+    Splits streamed text into sentences, each one is returned as soon as it is complete.
+    """
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text):
+        """
+        Adds streamed text.
+
+        Parameters:
+        - text (str): The next piece of text.
+
+        Returns:
+        - sentences (list): The sentences completed by this text.
+        """
+        self._buffer += text
+        sentences = []
+        end = 0
+        for match in SENTENCE_PATTERN.finditer(self._buffer):
+            sentence = match.group().strip()
+            if sentence:
+                sentences.append(sentence)
+            end = match.end()
+        self._buffer = self._buffer[end:]
+        return sentences
+
+    def flush(self):
+        """
+        Returns the remaining text at the end of the stream.
+
+        Returns:
+        - sentence (str): The last, possibly unterminated, sentence or "".
+        """
+        sentence = self._buffer.strip()
+        self._buffer = ""
+        return sentence
+
+def split_sentences(text):
+    """
+    Splits text into sentences.
+
+    Parameters:
+    - text (str): The text to split.
+
+    Returns:
+    - sentences (list): The sentences.
+    """
+    splitter = SentenceSplitter()
+    sentences = splitter.feed(text)
+    rest = splitter.flush()
+    if rest:
+        sentences.append(rest)
+    return sentences
+
+def commit_response(conversation, input_text, response):
+    """
+    Saves a turn to the conversation memory.
+
+    Parameters:
+    - conversation (ConversationChain): The conversation object containing the AI model state.
+    - input_text (str): The text input of the turn.
+    - response (str): The response of the turn.
+    """
+    memory = conversation.memory
+    memory.save_context({"input": input_text}, {"response": response})
+    if isinstance(memory, BoundedConversationMemory):
+        logging.debug(f"conversation memory stats: {memory.stats()}")
+
+def ai_text_response_stream(conversation, input_text, commit=True):
+    """
+    Streams the text response from the AI model sentence by sentence, so speech can start
+    before the whole response is generated. The response is saved to the conversation memory
+    once the stream ends.
+
+    Parameters:
+    - conversation (ConversationChain): The conversation object containing the AI model state.
+    - input_text (str): The text input to be processed by the AI model.
+    - commit (bool): If False, the response is not saved to the conversation memory, such as for
+      a speculative response that may be discarded, use commit_response() to save it later.
+
+    Yields:
+    - sentence (str): Each sentence of the response as soon as it is complete.
+    """
+    logging.debug("ai_text_response_stream start!")
+    ms_start = int(time.time() * 1000)
+
+    memory = conversation.memory
+    history = memory.load_memory_variables({"input": input_text})
+    messages = conversation.prompt.format_messages(input=input_text, **history)
+
+    splitter = SentenceSplitter()
+    chunks = []
+    first = True
+    for chunk in conversation.llm.stream(messages):
+        text = chunk.content if isinstance(chunk.content, str) else "".join(
+            part.get("text", "") if isinstance(part, dict) else str(part) for part in chunk.content)
+        chunks.append(text)
+        for sentence in splitter.feed(text):
+            if first:
+                first = False
+                logging.debug(f"first sentence, delay = {int(time.time() * 1000) - ms_start}ms")
+            yield sentence
+    rest = splitter.flush()
+    if rest:
+        yield rest
+
+    result = "".join(chunks)
+    logging.debug(f"text response: {result}")
+    ms_end = int(time.time() * 1000)
+    logging.debug(f"ai_text_response_stream end, delay = {ms_end - ms_start}ms")
+    if commit:
+        commit_response(conversation, input_text, result)
+
+class TextClassifier:
+    """
+    Classifies a text into one of a fixed set of labels with a single stateless model call.
+
+    Every request carries only the same small instructions and the text, there is no conversation
+    memory, so the prompt size stays the same on every call. The model answers with a label and
+    its own confidence. The label is constrained to the known labels, anything else is the default
+    label with low confidence, and a label that had to be found inside a longer answer is at most
+    medium confidence.
+    """
+    def __init__(self, llm, instructions, labels, default):
+        self.llm = llm
+        self.labels = list(labels)
+        self.default = default
+        label_list = ", ".join(self.labels)
+        self._system = SystemMessage(content=f"{instructions.strip()}\n\nAnswer with exactly one label from: {label_list}, "
+                                             f"then a comma and your confidence: high, medium or low. Example: dance,high")
+        self._system_tokens = estimate_tokens(self._system.content)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.unknown = 0
+        self.prompt_tokens = 0
+        self.delay_ms = 0
+
+    def _parse(self, answer):
+        answer = answer.strip().strip('"\'.` ').lower()
+        label, _, confidence = answer.partition(",")
+        label = label.strip().strip('"\'.` ')
+        confidence = confidence.strip().strip('"\'.` ')
+        if confidence not in ("high", "medium", "low"):
+            confidence = "low"
+        if label in self.labels:
+            return label, confidence
+        for label in sorted(self.labels, key=len, reverse=True):
+            if re.search(r'\b' + re.escape(label) + r'\b', answer):
+                return label, "low" if confidence == "low" else "medium"
+        return None, "low"
+
+    def classify(self, text):
+        """
+        Classifies a text.
+
+        Parameters:
+        - text (str): The text to classify.
+
+        Returns:
+        - label (str): One of the labels, the default label if the answer was not a label or the call failed.
+        - confidence (str): The confidence the model gave, "high", "medium" or "low", at most "medium" for a
+          label found inside a longer answer and "low" if it gave none.
+        """
+        tokens = self._system_tokens + estimate_tokens(text)
+        ms_start = int(time.time() * 1000)
+        try:
+            answer = self.llm.invoke([self._system, HumanMessage(content=text)]).content
+            label, confidence = self._parse(answer)
+        except Exception as e:
+            logging.error(f"classify error: {e}")
+            answer, label, confidence = "", None, "low"
+            with self._lock:
+                self.errors += 1
+        delay = int(time.time() * 1000) - ms_start
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += tokens
+            self.delay_ms += delay
+            if label is None and answer:
+                self.unknown += 1
+        logging.debug(f"classify: {label}, answer: {answer!r}, prompt tokens: {tokens}, delay = {delay}ms")
+        return (label or self.default), confidence
+
+    def stats(self):
+        """
+        Returns the call count, the failures and the mean prompt size and delay.
+
+        Returns:
+        - stats (dict): The calls, errors, answers that were no label, mean prompt tokens and mean delay in ms.
+        """
+        with self._lock:
+            calls = self.calls
+            return {
+                "calls": calls,
+                "errors": self.errors,
+                "unknown": self.unknown,
+                "mean_prompt_tokens": round(self.prompt_tokens / calls, 1) if calls else 0.0,
+                "mean_delay_ms": round(self.delay_ms / calls, 1) if calls else 0.0,
+            }
+
+
+def create_classifier_llm(max_output_tokens=16):
+    """
+    Creates a model instance for short deterministic answers, such as a classification label.
+
+    Parameters:
+    - max_output_tokens (int): The answer length limit.
+
+    Returns:
+    - llm (ChatVertexAI): The model instance.
+    """
+    return ChatVertexAI(
+        model_name='gemini-2.0-flash',
+        temperature=0,
+        max_output_tokens=max_output_tokens,
+    )
+
+def set_image_encoding(long_edge=None, quality=None, max_bytes=None):
+    """
+    Set the image encoding used for vision requests.
+
+    Parameters:
+    - long_edge (int, optional): Images are downsized so the longest edge is at most this many pixels.
+    - quality (int, optional): The starting JPEG quality.
+    - max_bytes (int, optional): The JPEG size target, quality is lowered until the image fits, 0 disables it.
+    """
+    global image_long_edge, image_jpeg_quality, image_max_bytes
+    if long_edge is not None:
+        image_long_edge = long_edge
+    if quality is not None:
+        image_jpeg_quality = quality
+    if max_bytes is not None:
+        image_max_bytes = max_bytes
+
+def _encode_jpeg(frame, quality):
+    # frame is a contiguous RGB uint8 array, prefer turbojpeg, then OpenCV, then PIL
+    if _turbojpeg is not None:
+        return _turbojpeg.encode(frame, quality=quality, pixel_format=TJPF_RGB)
+    try:
+        import cv2
+    except ImportError:
+        buffered = BytesIO()
+        Image.fromarray(frame).save(buffered, format="JPEG", quality=quality)
+        return buffered.getbuffer()
+    ok, encoded = cv2.imencode(".jpg", cv2.cvtColor(frame, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("jpeg encode failed")
+    return encoded
+
+def encode_image(image, long_edge=None, quality=None, max_bytes=None):
+    """
+    Downsizes and encodes an image to JPEG for a vision request.
+
+    Parameters:
+    - image (PIL.Image or numpy.ndarray): The image, numpy arrays are RGB.
+    - long_edge (int, optional): The longest edge in pixels, default is image_long_edge.
+    - quality (int, optional): The starting JPEG quality, default is image_jpeg_quality.
+    - max_bytes (int, optional): The JPEG size target, default is image_max_bytes.
+
+    Returns:
+    - jpeg: The JPEG data as a bytes-like object.
+    """
+    long_edge = image_long_edge if long_edge is None else long_edge
+    quality = image_jpeg_quality if quality is None else quality
+    max_bytes = image_max_bytes if max_bytes is None else max_bytes
+
+    if isinstance(image, np.ndarray):
+        frame = image
+    else:
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        frame = np.asarray(image)
+
+    height, width = frame.shape[:2]
+    if long_edge and max(width, height) > long_edge:
+        scale = long_edge / max(width, height)
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        try:
+            import cv2
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        except ImportError:
+            frame = np.asarray(Image.fromarray(frame).resize(size, Image.BILINEAR))
+    frame = np.ascontiguousarray(frame)
+
+    jpeg = _encode_jpeg(frame, quality)
+    while max_bytes and len(jpeg) > max_bytes and quality > IMAGE_MIN_JPEG_QUALITY:
+        quality = max(IMAGE_MIN_JPEG_QUALITY, quality - 15)
+        jpeg = _encode_jpeg(frame, quality)
+    logging.debug(f"jpeg {frame.shape[1]}x{frame.shape[0]}, quality {quality}, {len(jpeg)} bytes")
+    return jpeg
+
+def encode_image_data_url(image, **kwargs):
+    """
+    Encodes an image as a base64 JPEG data URL for a vision request.
+
+    Parameters:
+    - image (PIL.Image or numpy.ndarray): The image, numpy arrays are RGB.
+    - kwargs: The encode_image options.
+
+    Returns:
+    - data_url (str): The data URL.
+    """
+    jpeg = encode_image(image, **kwargs)
+    return "data:image/jpeg;base64," + base64.b64encode(jpeg).decode("ascii")
+
+class VisionCache:
+    """
+    Caches vision responses by a perceptual hash of the image and the normalized prompt,
+    so asking about a scene that has not changed is answered without calling Gemini.
+    """
+    def __init__(self, max_distance=3, ttl=30, max_entries=32):
+        self._max_distance = max_distance
+        self._ttl = ttl
+        self._entries = collections.deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def image_hash(image):
+        """
+        Computes a 64 bit difference hash (dHash) of the image.
+
+        Parameters:
+        - image (PIL.Image or numpy.ndarray): The image, numpy arrays are RGB.
+
+        Returns:
+        - image_hash (int): The hash, similar images have hashes with few different bits.
+        """
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        pixels = np.asarray(image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+        bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+        return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+    @staticmethod
+    def normalize_prompt(text):
+        return " ".join(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+
+    def get(self, image_hash, text):
+        """
+        Returns the cached response of a similar image with the same prompt.
+
+        Parameters:
+        - image_hash (int): The image hash from image_hash().
+        - text (str): The prompt.
+
+        Returns:
+        - response (str): The cached response, or None.
+        """
+        prompt = self.normalize_prompt(text)
+        now = time.monotonic()
+        with self._lock:
+            for entry_hash, entry_prompt, response, timestamp in reversed(self._entries):
+                if now - timestamp > self._ttl or entry_prompt != prompt:
+                    continue
+                if bin(entry_hash ^ image_hash).count("1") <= self._max_distance:
+                    self.hits += 1
+                    return response
+            self.misses += 1
+        return None
+
+    def put(self, image_hash, text, response):
+        """
+        Stores a response.
+
+        Parameters:
+        - image_hash (int): The image hash from image_hash().
+        - text (str): The prompt.
+        - response (str): The response from the AI model.
+        """
+        with self._lock:
+            self._entries.append((image_hash, self.normalize_prompt(text), response, time.monotonic()))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+vision_cache = VisionCache()
+
+def ai_image_response(llm, image, text, cache=None):
     """
     Generates a response from the AI model based on the provided image and text.
 
     Parameters:
     - llm (ChatVertexAI): The AI model instance for processing images.
-    - image (PIL.Image): The image object to be processed.
+    - image (PIL.Image or numpy.ndarray): The image object to be processed, numpy arrays are RGB.
     - text (str): The accompanying text for the image.
+    - cache (VisionCache, optional): Return the cached response for the same scene and prompt.
 
     Returns:
     - result (str): The text response generated by the AI model.
@@ -145,12 +705,15 @@ def ai_image_response(llm, image, text):
     logging.debug("ai_image_response start!")
     ms_start = int(time.time() * 1000)
 
-    buffered = BytesIO()
-    image.save(buffered, format="JPEG")
-    image_bytes = buffered.getvalue()
+    if cache is not None:
+        image_hash = cache.image_hash(image)
+        result = cache.get(image_hash, text)
+        if result is not None:
+            logging.debug(f"ai_image_response cache hit ({cache.hits} hits, {cache.misses} misses): {result}")
+            return result
 
-    image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-    image_data_url = f"data:image/jpeg;base64,{image_base64}"
+    image_data_url = encode_image_data_url(image)
+    logging.debug(f"image encoded, {len(image_data_url)} bytes")
 
     image_message = {
         "type": "image_url",
@@ -167,6 +730,8 @@ def ai_image_response(llm, image, text):
     #logging.debug(f"ai_image_response response: {output}")
     result = output.content
     logging.debug(f"text response: {result}")
+    if cache is not None:
+        cache.put(image_hash, text, result)
     ms_end = int(time.time() * 1000)
     logging.debug(f"ai_image_response end, delay = {ms_end - ms_start}ms")
     return result
@@ -208,14 +773,24 @@ def init_speech_to_text():
 
 # Note:  Very important!!!
 # After you called this function start_speech_to_text(), You need to call stop_speech_to_text() some time later, not immediately because it will crash
+# This does not apply when the audio is read from an audio_api.MicrophoneRing source.
 # Function to detect voice and transribe speech
-def start_speech_to_text(speech_client, py_audio):
+def start_speech_to_text(speech_client, py_audio, vad=None, resampler=None, source=None, endpointer=None):
     """
     Starts the speech-to-text process to transcribe audio input to text.
 
     Parameters:
     - speech_client (speech.SpeechClient): The initialized Speech-to-Text client.
     - py_audio (pyaudio.PyAudio): The PyAudio instance for handling audio streams.
+    - vad (audio_api.VoiceActivityDetector, optional): If given, the cloud stream is only opened
+      once local voice activity detection hears speech, starting with the pre-roll audio.
+    - resampler (audio_api.Resampler, optional): If given, the audio is downmixed and resampled,
+      such as to 16 kHz mono, before it is checked by the vad and sent.
+    - source (audio_api.MicrophoneRing, optional): If given, the audio is read from a cursor on the
+      always-on microphone ring buffer instead of a new PyAudio stream.
+    - endpointer (audio_api.Endpointer, optional): If given, the audio stream to the server is closed
+      as soon as the endpointer hears the end of the utterance, and the last interim transcript is
+      used if the server then returns no final result.
 
     Returns:
     - user_input (str): The transcribed text from the audio input.
@@ -225,14 +800,17 @@ def start_speech_to_text(speech_client, py_audio):
     RATE = 48000
     CHUNK = int(RATE / 10)
 
-    def audio_generator(stream, chunk):
+    def audio_generator(read_chunk):
         try:
             while True:
-                data = stream.read(chunk)
+                data = read_chunk()
                 if not data:
                     # End of stream, break out of the loop
                     break
                 yield data
+                if endpointer is not None and endpointer.process(data):
+                    # half-close the request stream, the server finalizes what it has heard
+                    break
         except Exception as e:
             # Handle any exceptions that may occur while reading from the stream
             logging.error(f"Error reading from audio stream: {e}")
@@ -240,23 +818,49 @@ def start_speech_to_text(speech_client, py_audio):
             yield None
 
 
-    stream = py_audio.open(format=pyaudio.paInt16,
-                    channels=2,
-                    rate=RATE,
-                    input=True,
-                    frames_per_buffer=CHUNK)
-
-    requests = (speech.StreamingRecognizeRequest(audio_content=content) for content in audio_generator(stream, CHUNK) if content)
+    if source is not None:
+        stream = source.cursor()
+    else:
+        stream = py_audio.open(format=pyaudio.paInt16,
+                        channels=2,
+                        rate=RATE,
+                        input=True,
+                        frames_per_buffer=CHUNK)
+
+    rate = RATE
+    channels = 2
+    if resampler is not None:
+        resampler.reset()
+        rate = resampler.out_rate
+        channels = 1
+
+    def read_chunk():
+        data = stream.read(CHUNK, exception_on_overflow=False)
+        if resampler is not None and data:
+            data = resampler.process(data)
+        return data
+
+    if endpointer is not None:
+        endpointer.reset()
+
+    first_chunks = []
+    if vad is not None:
+        vad.reset()
+        first_chunks = vad.wait_for_speech(read_chunk)
+        logging.debug(f"vad stats: {vad.stats()}")
+
+    audio_chunks = itertools.chain(first_chunks, audio_generator(read_chunk))
+    requests = (speech.StreamingRecognizeRequest(audio_content=content) for content in audio_chunks if content)
 
     streaming_config = speech.StreamingRecognitionConfig(
         config=speech.RecognitionConfig(
             encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=RATE,
+            sample_rate_hertz=rate,
             language_code=language_code,
             use_enhanced=True,
             model="phone_call",
-            audio_channel_count=2,
-            enable_separate_recognition_per_channel=True,
+            audio_channel_count=channels,
+            enable_separate_recognition_per_channel=channels > 1,
         ),
         interim_results=True
     )
@@ -265,6 +869,7 @@ def start_speech_to_text(speech_client, py_audio):
     user_input = ""
     should_break=False
     for response in responses:
+        interim = ""
         for result in response.results:
             if result.is_final:
                 if result.alternatives:
@@ -272,8 +877,19 @@ def start_speech_to_text(speech_client, py_audio):
                     logging.debug(user_input)
                     should_break = True
                     break
+            elif result.alternatives:
+                interim += result.alternatives[0].transcript
         if should_break:
             break
+        if endpointer is not None and interim:
+            endpointer.on_interim(interim)
+    if endpointer is not None:
+        if should_break:
+            endpointer.on_final()
+        elif endpointer.local_time is not None:
+            user_input = endpointer.transcript
+            logging.debug(f"no final result after the local endpoint, use the interim: {user_input}")
+        logging.debug(f"endpoint stats: {endpointer.stats()}")
     logging.debug(f"voice text:{user_input}")
     #stream.stop_stream()
     #stream.close()
@@ -319,42 +935,475 @@ def init_text_to_speech():
     return tts_client, voice, audio_config
 
 
-def text_to_speech(text, tts_client, voice, audio_config):
+class TTSCache:
     """
-    Converts the provided text to speech using the Google Cloud Text-to-Speech service.
+    Two-tier cache of synthesized PCM keyed by text, voice and audio config: an in-memory LRU
+    backed by files on disk, so canned responses play instantly and also offline.
+    Both tiers evict the least recently used entries to stay within their byte budget.
+    """
+    def __init__(self, folder=TTS_CACHE_DIR, max_memory_bytes=TTS_CACHE_MEMORY_BYTES,
+                 max_disk_bytes=TTS_CACHE_DISK_BYTES):
+        self._folder = folder
+        self._max_memory_bytes = max_memory_bytes
+        self._max_disk_bytes = max_disk_bytes
+        self._memory = collections.OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(text, voice, audio_config):
+        """
+        Builds the cache key.
+
+        Parameters:
+        - text (str): The text to synthesize.
+        - voice (texttospeech.VoiceSelectionParams): The voice.
+        - audio_config (texttospeech.AudioConfig): The audio configuration.
+
+        Returns:
+        - key (str): The cache key.
+        """
+        parts = [text, voice.language_code, voice.name, str(voice.ssml_gender),
+                 str(audio_config.audio_encoding), str(audio_config.sample_rate_hertz),
+                 str(audio_config.speaking_rate), str(audio_config.pitch), str(audio_config.volume_gain_db)]
+        return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._folder, f"{key}.pcm")
+
+    def get(self, key):
+        """
+        Returns the cached PCM.
+
+        Parameters:
+        - key (str): The key from make_key().
+
+        Returns:
+        - pcm (bytes): The 16 bit PCM, or None.
+        """
+        with self._lock:
+            pcm = self._memory.get(key)
+            if pcm is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return pcm
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                pcm = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+            self._put_memory(key, pcm)
+        return pcm
+
+    def put(self, key, pcm):
+        """
+        Stores PCM in both tiers.
+
+        Parameters:
+        - key (str): The key from make_key().
+        - pcm (bytes): The 16 bit PCM.
+        """
+        with self._lock:
+            self._put_memory(key, pcm)
+        try:
+            os.makedirs(self._folder, exist_ok=True)
+            tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(pcm)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logging.error(f"tts cache write error: {e}")
+            return
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(pcm)
+            self._evict_disk()
+
+    def _put_memory(self, key, pcm):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        if len(pcm) > self._max_memory_bytes:
+            return
+        self._memory[key] = pcm
+        self._memory_bytes += len(pcm)
+        while self._memory_bytes > self._max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _evict_disk(self):
+        if self._disk_bytes is not None and self._disk_bytes <= self._max_disk_bytes:
+            return
+        files = []
+        for name in os.listdir(self._folder):
+            if name.endswith(".pcm"):
+                stat = os.stat(os.path.join(self._folder, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+        self._disk_bytes = sum(size for _, size, _ in files)
+        files.sort()
+        for _, size, name in files:
+            if self._disk_bytes <= self._max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self._folder, name))
+                self._disk_bytes -= size
+            except OSError as e:
+                logging.error(f"tts cache evict error: {e}")
+                break
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+        - stats (dict): The hit and miss counts, hit rate and memory usage.
+        """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+            }
+
+tts_cache = TTSCache()
+
+def _wav_to_pcm(audio_content):
+    # LINEAR16 responses are WAV files, keep only the samples of the data chunk
+    if audio_content[:4] == b"RIFF":
+        index = audio_content.find(b"data", 12)
+        if index != -1:
+            return audio_content[index + 8:]
+    return audio_content
+
+def synthesize_speech(text, tts_client, voice, audio_config, cache=tts_cache):
+    """
+    Synthesizes text to 16 bit PCM, using the cache when possible.
 
     Parameters:
     - text (str): The text to be converted to speech.
     - tts_client (texttospeech.TextToSpeechClient): The initialized Text-to-Speech client.
     - voice (texttospeech.VoiceSelectionParams): The voice instance to be used for speech synthesis.
     - audio_config (texttospeech.AudioConfig): The audio configuration instance.
+    - cache (TTSCache, optional): The audio cache, None disables it.
 
     Returns:
-    - None, but plays the synthesized speech to the audio output.
+    - audio_data (numpy.ndarray): The int16 samples.
     """
     ms_start = int(time.time() * 1000)
-    synthesis_input = texttospeech.SynthesisInput(text=text)
+    key = None
+    if cache is not None:
+        key = cache.make_key(text, voice, audio_config)
+        pcm = cache.get(key)
+        if pcm is not None:
+            logging.debug(f"tts cache hit: {text}")
+            return np.frombuffer(pcm, dtype=np.int16)
 
+    synthesis_input = texttospeech.SynthesisInput(text=text)
     response = tts_client.synthesize_speech(input=synthesis_input, voice=voice, audio_config=audio_config)
-
-    audio_data = np.frombuffer(response.audio_content, dtype=np.int16)
+    pcm = _wav_to_pcm(response.audio_content)
+    if cache is not None:
+        cache.put(key, pcm)
     ms_end = int(time.time() * 1000)
     logging.debug(f"google tts end, delay = {ms_end - ms_start}ms")
+    return np.frombuffer(pcm, dtype=np.int16)
 
+class AudioPlayer:
+    """
+    Plays 16 bit mono audio through one long-lived sounddevice output stream.
 
-    logging.debug(sd.default.device)
-    # specfiy the innner audio play device "bcm2835 Headphones" on mini pupper
-    try:
-        audio_device = sd.query_devices("headphone")
-        logging.info(audio_device)
-        sd.default.device[1] = audio_device.get("index", sd.default.device[1])
-        logging.debug(sd.default.device)
-    except Exception as e:
-        logging.error(e)
+    The output device is resolved and the stream opened once. Audio is queued in chunks that
+    the stream callback consumes, so playback starts with the first chunk while more audio is
+    still being added. The callback takes no locks, it only pops from a deque. Each chunk is
+    tagged with the generation it was written in, stop() only bumps the generation and the
+    callback drops the chunks of older generations itself.
+    """
+    def __init__(self, samplerate=TTS_SAMPLE_RATE, device_name=AUDIO_OUTPUT_DEVICE,
+                 chunk_frames=AUDIO_CHUNK_FRAMES):
+        self._samplerate = samplerate
+        self._device_name = device_name
+        self._chunk_frames = chunk_frames
+        self._chunks = collections.deque()
+        self._current = None
+        self._offset = 0
+        self._ended = True
+        self._drained = threading.Event()
+        self._open_lock = threading.Lock()
+        self._stream = None
+        self.generation = 0
+        self.underruns = 0
+
+    def open(self):
+        """
+        Resolves the output device and starts the output stream if it is not running yet.
+        """
+        with self._open_lock:
+            if self._stream is not None:
+                if self._stream.active:
+                    return
+                # a stream aborted by an error in the callback is replaced
+                logging.error("audio output stream stopped, reopening")
+                self._stream.close()
+                self._stream = None
+            device = None
+            try:
+                audio_device = sd.query_devices(self._device_name)
+                logging.info(audio_device)
+                device = audio_device.get("index")
+            except Exception as e:
+                logging.error(e)
+            self._stream = sd.OutputStream(samplerate=self._samplerate, channels=1, dtype="int16",
+                                           device=device, callback=self._callback)
+            self._stream.start()
+            logging.debug(f"audio output stream open, latency = {self._stream.latency}s")
+
+    def close(self):
+        """
+        Stops playback and closes the output stream.
+        """
+        self.stop()
+        with self._open_lock:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+
+    def _callback(self, outdata, frames, time_info, status):
+        # other threads only append chunks and bump the generation, the playback state is
+        # read once and written back at the end
+        generation = self.generation
+        current = self._current
+        offset = self._offset
+        if current is not None and current[0] != generation:
+            current = None
+        out = outdata[:, 0]
+        filled = 0
+        while filled < frames:
+            if current is None:
+                try:
+                    current = self._chunks.popleft()
+                except IndexError:
+                    break
+                if current[0] != generation:
+                    current = None
+                    continue
+                offset = 0
+            samples = current[1]
+            count = min(frames - filled, len(samples) - offset)
+            out[filled:filled + count] = samples[offset:offset + count]
+            filled += count
+            offset += count
+            if offset >= len(samples):
+                current = None
+        self._current = current
+        self._offset = offset
+        # the producer has more audio but it has not arrived in time
+        starved = filled < frames and current is None and not self._ended
+        if status.output_underflow or starved:
+            self.underruns += 1
+        if filled < frames:
+            out[filled:] = 0
+            if current is None and not self._chunks:
+                self._drained.set()
+
+    def write(self, audio_data, generation=None):
+        """
+        Queues audio, playback starts as soon as the first chunk is queued.
+        Call finish() after the last write of an utterance.
+
+        Parameters:
+        - audio_data (numpy.ndarray): The int16 samples.
+        - generation (int): The generation the audio belongs to, it is dropped if stop() was
+          called since. Defaults to the current generation.
+        """
+        if generation is None:
+            generation = self.generation
+        elif generation != self.generation:
+            return
+        self.open()
+        self._ended = False
+        for start in range(0, len(audio_data), self._chunk_frames):
+            self._chunks.append((generation, audio_data[start:start + self._chunk_frames]))
+
+    def finish(self):
+        """
+        Marks the end of the queued audio, running out of audio is no longer an underrun.
+        """
+        self._ended = True
+
+    def play(self, audio_data):
+        """
+        Queues a complete utterance.
+
+        Parameters:
+        - audio_data (numpy.ndarray): The int16 samples.
+        """
+        self.write(audio_data)
+        self.finish()
+
+    def wait(self):
+        """
+        Blocks until all queued audio has been played.
+        """
+        while not (self._ended and self._current is None and not self._chunks):
+            self._drained.wait(0.1)
+            self._drained.clear()
+        if self._stream is not None:
+            time.sleep(self._stream.latency)
+
+    def stop(self):
+        """
+        Interrupts playback, the queued audio is dropped by the stream callback.
+        """
+        self.generation += 1
+        self._ended = True
+        self._drained.set()
+
+audio_player = AudioPlayer()
+_tts_executor = ThreadPoolExecutor(max_workers=TTS_SYNTHESIS_WORKERS)
+
+# synthesis futures in speaking order, one writer thread queues their audio to the player
+_speech_queue = queue.Queue()
+_speech_pending = 0
+_speech_cond = threading.Condition()
+_speech_writer = None
+
+def _write_speech():
+    global _speech_pending
+    while True:
+        generation, future = _speech_queue.get()
+        try:
+            if audio_player.generation != generation:
+                future.cancel()
+                logging.debug("tts interrupted")
+            else:
+                audio_data = future.result()
+                audio_player.write(audio_data, generation)
+        except Exception as e:
+            logging.error(f"tts synthesis error:{e}")
+        finally:
+            with _speech_cond:
+                _speech_pending -= 1
+                _speech_cond.notify_all()
+
+def speak_async(text, tts_client, voice, audio_config):
+    """
+    Starts synthesizing the sentences of a text and queues them for playback after the speech
+    already queued, without waiting. Consecutive calls overlap the synthesis of a text with the
+    playback of the texts before it.
+
+    Parameters:
+    - text (str): The text to be converted to speech.
+    - tts_client (texttospeech.TextToSpeechClient): The initialized Text-to-Speech client.
+    - voice (texttospeech.VoiceSelectionParams): The voice instance to be used for speech synthesis.
+    - audio_config (texttospeech.AudioConfig): The audio configuration instance.
+    """
+    global _speech_writer, _speech_pending
+    sentences = split_sentences(text) or [text]
+    with _speech_cond:
+        if _speech_writer is None:
+            _speech_writer = threading.Thread(target=_write_speech, daemon=True)
+            _speech_writer.start()
+        _speech_pending += len(sentences)
+    generation = audio_player.generation
+    for sentence in sentences:
+        _speech_queue.put((generation, _tts_executor.submit(synthesize_speech, sentence, tts_client,
+                                                            voice, audio_config)))
+
+def wait_speaking():
+    """
+    Blocks until all the speech queued with speak_async() has been played.
+    """
+    with _speech_cond:
+        while _speech_pending:
+            _speech_cond.wait(0.1)
+    audio_player.finish()
+    audio_player.wait()
+    logging.debug(f"tts play end, underruns: {audio_player.underruns}")
+
+def stop_speaking():
+    """
+    Interrupts the speech that is playing, the queued speech is dropped.
+    """
+    audio_player.stop()
+
+def warm_tts_cache(texts, tts_client, voices, audio_config, max_workers=3, cache=tts_cache):
+    """
+    Synthesizes every text with every voice into the cache in a background thread,
+    using a bounded pool of concurrent requests. Texts are split into sentences like
+    text_to_speech does, sentences already cached are skipped.
+
+    Parameters:
+    - texts (list): The texts to synthesize.
+    - tts_client (texttospeech.TextToSpeechClient): The initialized Text-to-Speech client.
+    - voices (list): The texttospeech.VoiceSelectionParams to synthesize with.
+    - audio_config (texttospeech.AudioConfig): The audio configuration instance.
+    - max_workers (int): The maximum number of concurrent synthesis requests.
+    - cache (TTSCache): The audio cache to fill.
+
+    Returns:
+    - thread (threading.Thread): The started background thread.
+    """
+    def warm():
+        ms_start = int(time.time() * 1000)
+        errors = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            sentences = dict.fromkeys(sentence for text in texts for sentence in split_sentences(text))
+            futures = [executor.submit(synthesize_speech, sentence, tts_client, voice, audio_config, cache)
+                       for voice in voices for sentence in sentences]
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    errors += 1
+                    logging.error(f"tts warm up error: {e}")
+        ms_end = int(time.time() * 1000)
+        logging.debug(f"tts warm up end, {len(futures)} phrases, {errors} errors, "
+                      f"delay = {ms_end - ms_start}ms, cache: {cache.stats()}")
+
+    thread = threading.Thread(target=warm, daemon=True)
+    thread.start()
+    return thread
+
+def text_to_speech(text, tts_client, voice, audio_config, wait=True):
+    """
+    Converts the provided text to speech using the Google Cloud Text-to-Speech service.
+
+    The sentences are synthesized concurrently and played in order as each one is ready, so the
+    request for the next sentence overlaps with the playback of the current one.
+
+    Parameters:
+    - text (str): The text to be converted to speech.
+    - tts_client (texttospeech.TextToSpeechClient): The initialized Text-to-Speech client.
+    - voice (texttospeech.VoiceSelectionParams): The voice instance to be used for speech synthesis.
+    - audio_config (texttospeech.AudioConfig): The audio configuration instance.
+    - wait (bool): If False, return once the text is queued, such as for a streamed sentence
+      that more sentences follow, call wait_speaking() after the last one.
+
+    Returns:
+    - None, but plays the synthesized speech to the audio output.
+    """
     try:
-        sd.play(audio_data, 24000)
-        sd.wait()
+        speak_async(text, tts_client, voice, audio_config)
+        if wait:
+            wait_speaking()
     except Exception as e:
+        audio_player.stop()
         logging.error(f"tts play error:{e}")
 
 
@@ -404,6 +1453,14 @@ def main():
                 response = ai_text_response(conversation=conversation, input_text=input_text)
                 print(response)
 
+        elif "stream" == first_word:
+            input_text = ' '.join(inputs[1:])
+            if not input_text:
+                logging.debug("No input text!")
+            else:
+                for sentence in ai_text_response_stream(conversation, input_text):
+                    print(sentence)
+
         elif "image" == first_word:
             import media_api
             image = media_api.take_photo()
@@ -20,40 +20,486 @@
 # Displaying Photo from Path Test Method: Type 'path', press enter, then type the path to your desired photo, then press enter.
 # Resizing Photo and Displaying Test Method: Type 'resize', press enter, then type the path to your desired photo, then press enter.
 # Displaying GIF Test Method: Type 'gif', then press enter.
+# Batch Resizing Test Method: Type 'batch', press enter, then type the image folder and the output folder, pressing enter after each.
+# Import Time Test Method: Type 'import', then press enter.
+# Resizing Benchmark Test Method: Type 'bench', press enter, then type the path to your desired photo, then press enter.
+# Photo Prefetch Test Method: Type 'prefetch', then press enter. The take_photo delay with a cold camera and with a
+# photo prefetched is printed.
 #
 
 import logging
-import cv2
 import numpy as np
 from PIL import Image
 import sys
 import os
+import time
+import threading
+import collections
+import functools
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from MangDang.LCD.ST7789 import ST7789
 from api.gif import AnimatedGif
 
-disp = ST7789()
-disp.begin()
+# cv2 and the display driver are imported on first use, importing this module must stay cheap
+IMPORT_TIME_BUDGET_MS = 300
 
-def take_photo():
+# default hardware backends, override them in .env, such as DISPLAY_BACKEND=null on a PC without the panel
+DISPLAY_BACKEND = "st7789"
+CAMERA_BACKEND = "opencv"
+
+# camera capture service defaults
+CAMERA_INDEX = 0
+CAMERA_BUFFER_SIZE = 4
+CAMERA_WARMUP_FRAMES = 3
+CAMERA_IDLE_TIMEOUT = 60
+CAMERA_READ_TIMEOUT = 2.0
+
+# a photo captured ahead of the request is only handed over while it is this fresh, in seconds
+PHOTO_PREFETCH_MAX_AGE = 10
+
+# display compositor defaults, renders are paced to the measured panel write time and never exceed DISPLAY_MAX_FPS
+DISPLAY_WIDTH = 320
+DISPLAY_HEIGHT = 240
+DISPLAY_MAX_FPS = 20
+
+# the image sizes made by the resize and batch tools, (width, height)
+RESIZE_DIMENSIONS = [
+    (720, 1080),
+    (480, 720),
+    (320, 480),
+    (240, 320),
+]
+RESIZE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+# the cartoons shown on the display
+ASSET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cartoons")
+
+
+class NullDisplay:
     """
-    Captures a photo from the webcam and returns it as a PIL Image object.
+    A display backend that drops every frame, for machines without the LCD panel.
+    """
+    width = DISPLAY_WIDTH
+    height = DISPLAY_HEIGHT
+
+    def begin(self):
+        pass
+
+    def display(self, image):
+        pass
+
+
+def _open_st7789():
+    from MangDang.LCD.ST7789 import ST7789
+    display = ST7789()
+    display.begin()
+    return display
+
+def _open_opencv_camera(index):
+    import cv2
+    return cv2.VideoCapture(index)
+
+_display_backends = {
+    "st7789": _open_st7789,
+    "null": NullDisplay,
+}
+_camera_backends = {
+    "opencv": _open_opencv_camera,
+}
+
+def register_display_backend(name, factory):
+    """
+    Registers a display backend, select it with the DISPLAY_BACKEND environment variable.
+
+    Parameters:
+    - name (str): The backend name.
+    - factory (callable): Returns a ready display object with a display(image) method.
+    """
+    _display_backends[name] = factory
+
+def register_camera_backend(name, factory):
+    """
+    Registers a camera backend, select it with the CAMERA_BACKEND environment variable.
+
+    Parameters:
+    - name (str): The backend name.
+    - factory (callable): Takes the camera index and returns an object with the cv2.VideoCapture
+      isOpened(), read() and release() methods.
+    """
+    _camera_backends[name] = factory
+
+_display = None
+_display_lock = threading.Lock()
+
+def get_display():
+    """
+    Returns the display, the configured backend is initialized on first use.
+    Falls back to the null backend if the display can not be initialized.
 
     Returns:
-    - image (PIL.Image): The captured image or None if the webcam is not accessible.
+    - display: The display object.
+    """
+    global _display
+    with _display_lock:
+        if _display is None:
+            backend = os.environ.get("DISPLAY_BACKEND", DISPLAY_BACKEND)
+            ms_start = int(time.time() * 1000)
+            try:
+                _display = _display_backends[backend]()
+            except Exception as e:
+                logging.error(f"display backend {backend} init error: {e}, use null display")
+                _display = NullDisplay()
+            ms_end = int(time.time() * 1000)
+            logging.debug(f"display init end, delay = {ms_end - ms_start}ms")
+        return _display
+
+def open_camera(index):
+    """
+    Opens the camera with the configured backend.
+
+    Parameters:
+    - index (int): The camera index.
+
+    Returns:
+    - cap: The opened capture object, check it with isOpened().
+    """
+    backend = os.environ.get("CAMERA_BACKEND", CAMERA_BACKEND)
+    return _camera_backends[backend](index)
+
+def __getattr__(name):
+    # keep media_api.disp working, the display is created on first access
+    if name == "disp":
+        return get_display()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def measure_import_time():
+    """
+    Measures the time to import this module in a fresh interpreter.
+
+    Returns:
+    - import_ms (float): The import time in milliseconds.
+    """
+    code = ("import time; start = time.perf_counter(); import api.media_api; "
+            "print((time.perf_counter() - start) * 1000)")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", code], cwd=root, check=True,
+                            text=True, stdout=subprocess.PIPE)
+    return float(result.stdout.strip())
+
+
+class CameraService:
+    """
+    Owns the webcam and keeps the latest frames in a small ring buffer.
+
+    A background thread reads frames continuously, so callers grab the freshest frame
+    without paying the device open and auto-exposure warm-up cost on every photo.
+    Frames are BGR numpy arrays shared between callers, treat them as read-only.
+    Every start and frame request counts as a use, stop_if_unused() releases the camera only
+    if nobody used it since a given use.
+    """
+    def __init__(self, index=CAMERA_INDEX, buffer_size=CAMERA_BUFFER_SIZE,
+                 warmup_frames=CAMERA_WARMUP_FRAMES, idle_timeout=CAMERA_IDLE_TIMEOUT):
+        self._index = index
+        self._warmup_frames = warmup_frames
+        self._idle_timeout = idle_timeout
+        self._frames = collections.deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._last_access = time.monotonic()
+        self._uses = 0
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def uses(self):
+        return self._uses
+
+    def start(self):
+        """
+        Opens the camera and starts the capture thread if it is not running yet.
+
+        Returns:
+        - started (bool): True if the camera is capturing, False if it could not be opened.
+        """
+        with self._cond:
+            self._uses += 1
+        with self._start_lock:
+            if self._running:
+                return True
+            if self._thread is not None:
+                # a capture thread is shutting down after idling, wait until it releases the device
+                self._thread.join()
+
+            cap = open_camera(self._index)
+            if not cap.isOpened():
+                cap.release()
+                logging.error(f"camera {self._index} can not be opened")
+                return False
+
+            for _ in range(self._warmup_frames):
+                cap.read()
+
+            self._last_access = time.monotonic()
+            self._running = True
+            self._thread = threading.Thread(target=self._capture_loop, args=(cap,), daemon=True)
+            self._thread.start()
+            logging.debug(f"camera {self._index} capture start")
+        return True
+
+    def stop(self):
+        """
+        Stops the capture thread and releases the camera.
+        """
+        with self._start_lock:
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
+            if self._thread is not None and self._thread is not threading.current_thread():
+                self._thread.join()
+                self._thread = None
+
+    def stop_if_unused(self, uses):
+        """
+        Stops the camera unless it was used since, the camera is otherwise left to the idle shutdown.
+
+        Parameters:
+        - uses (int): The use count read after the caller's own last use.
+
+        Returns:
+        - stopped (bool): True if the camera was stopped.
+        """
+        with self._start_lock:
+            with self._cond:
+                if self._uses != uses:
+                    return False
+                self._running = False
+                self._cond.notify_all()
+            if self._thread is not None and self._thread is not threading.current_thread():
+                self._thread.join()
+                self._thread = None
+        return True
+
+    def _capture_loop(self, cap):
+        try:
+            while True:
+                ret, frame = cap.read()
+                timestamp = time.monotonic()
+                with self._cond:
+                    if not self._running:
+                        break
+                    if self._idle_timeout and timestamp - self._last_access > self._idle_timeout:
+                        logging.debug(f"camera idle for {self._idle_timeout}s, release it")
+                        self._running = False
+                        break
+                    if ret:
+                        self._frames.append((timestamp, frame))
+                        self._cond.notify_all()
+                if not ret:
+                    logging.error("camera read frame failed")
+                    time.sleep(0.1)
+        finally:
+            with self._cond:
+                self._frames.clear()
+                self._cond.notify_all()
+            cap.release()
+            logging.debug(f"camera {self._index} capture stop")
+
+    def latest_frame(self, newer_than=None, timeout=CAMERA_READ_TIMEOUT):
+        """
+        Returns the freshest frame from the ring buffer, starting the camera if needed.
+
+        Parameters:
+        - newer_than (float, optional): Only accept a frame captured after this time.monotonic() timestamp.
+        - timeout (float): The maximum seconds to wait for a suitable frame.
+
+        Returns:
+        - timestamp (float): The time.monotonic() capture time, or None on failure.
+        - frame (numpy.ndarray): The BGR frame, or None on failure.
+        """
+        with self._cond:
+            self._uses += 1
+            running = self._running
+        if not running and not self.start():
+            return None, None
+
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._last_access = time.monotonic()
+            while True:
+                if self._frames:
+                    timestamp, frame = self._frames[-1]
+                    if newer_than is None or timestamp > newer_than:
+                        return timestamp, frame
+                remaining = deadline - time.monotonic()
+                if not self._running or remaining <= 0:
+                    return None, None
+                self._cond.wait(remaining)
+
+
+_camera = None
+_camera_lock = threading.Lock()
+
+def get_camera():
+    """
+    Returns the shared camera capture service, it is created on first use.
+
+    Returns:
+    - camera (CameraService): The camera capture service.
     """
-    cap = cv2.VideoCapture(0)
+    global _camera
+    with _camera_lock:
+        if _camera is None:
+            _camera = CameraService()
+        return _camera
 
-    if not cap.isOpened():
+def _capture_photo(width=None):
+    import cv2
+    timestamp, frame = get_camera().latest_frame()
+    if frame is None:
         return None
+    if width:
+        frame = resize_array_to_width(frame, width)
+    return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+
+class PhotoPrefetch:
+    """
+    A photo captured on a background thread before it is requested, such as as soon as the user
+    asks for a photo and while the request is still being routed.
+    """
+    def __init__(self, width=None):
+        self.width = width
+        self.created = time.monotonic()
+        self.image = None
+        # a camera the prefetch had to start is released again if the photo is discarded
+        self.started_camera = not get_camera().running
+        self._uses = None
+        self._done = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _release(self):
+        self.result()
+        with _prefetch_lock:
+            newer = _prefetch is not None
+        # a newer prefetch, the game or a photo may use the camera now, it is left to the idle shutdown then
+        if not newer and self._uses is not None and get_camera().stop_if_unused(self._uses):
+            logging.debug("camera started for a discarded photo prefetch released")
+
+    def discard(self):
+        """
+        Drops the photo, and releases the camera in the background if the prefetch started it
+        and nobody used the camera since.
+        """
+        if self.started_camera:
+            threading.Thread(target=self._release, daemon=True).start()
+
+    def _run(self):
+        try:
+            self.image = _capture_photo(self.width)
+            self._uses = get_camera().uses
+        except Exception as e:
+            logging.error(f"photo prefetch error: {e}")
+        finally:
+            self._done.set()
+
+    def result(self, timeout=None):
+        """
+        Waits for the capture.
+
+        Parameters:
+        - timeout (float, optional): The maximum seconds to wait, by default as long as a camera start can take.
+
+        Returns:
+        - image (PIL.Image): The captured image or None if the capture failed or is not finished.
+        """
+        self._done.wait(CAMERA_READ_TIMEOUT * 2 if timeout is None else timeout)
+        return self.image
+
+
+_prefetch = None
+_prefetch_lock = threading.Lock()
+prefetch_stats = {"started": 0, "used": 0, "discarded": 0}
+
+def prefetch_photo(width=None):
+    """
+    Starts capturing a photo that the next take_photo() with the same width hands over, so the
+    camera start and the conversion are not paid when the photo is needed. A photo that is
+    not taken within PHOTO_PREFETCH_MAX_AGE seconds, or discarded, is dropped.
 
-    ret, frame = cap.read()
-    image = None
-    if ret:
-        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-    cap.release()
-    return image
+    Parameters:
+    - width (int, optional): The width the photo will be requested with.
+
+    Returns:
+    - prefetch (PhotoPrefetch): The capture in progress.
+    """
+    global _prefetch
+    prefetch = PhotoPrefetch(width)
+    with _prefetch_lock:
+        replaced = _prefetch
+        if replaced is not None:
+            prefetch_stats["discarded"] += 1
+        _prefetch = prefetch
+        prefetch_stats["started"] += 1
+    if replaced is not None:
+        replaced.discard()
+    logging.debug(f"photo prefetch start, width {width}")
+    return prefetch
+
+def discard_prefetch():
+    """
+    Drops a prefetched photo that is not going to be used.
+    """
+    global _prefetch
+    with _prefetch_lock:
+        prefetch = _prefetch
+        _prefetch = None
+        if prefetch is not None:
+            prefetch_stats["discarded"] += 1
+    if prefetch is not None:
+        prefetch.discard()
+        logging.debug("photo prefetch discarded")
+
+def warm_camera():
+    """
+    Starts the camera capture in the background without taking a photo, for a photo that must be
+    taken at a later moment, such as at "Shoot!" in the rock paper scissors game.
+    """
+    camera = get_camera()
+    if not camera.running:
+        threading.Thread(target=camera.start, daemon=True).start()
+
+def take_photo(width=None):
+    """
+    Captures a photo from the webcam and returns it as a PIL Image object.
+
+    A photo prefetched with the same width is handed over instead, if it is fresh enough.
+
+    Parameters:
+    - width (int, optional): Resize the photo to this width, keeping the aspect ratio, before conversion.
+
+    Returns:
+    - image (PIL.Image): The captured image or None if the webcam is not accessible.
+    """
+    global _prefetch
+    with _prefetch_lock:
+        prefetch = _prefetch
+        _prefetch = None
+    if prefetch is not None:
+        image = None
+        if prefetch.width == width and time.monotonic() - prefetch.created <= PHOTO_PREFETCH_MAX_AGE:
+            image = prefetch.result()
+        with _prefetch_lock:
+            prefetch_stats["used" if image is not None else "discarded"] += 1
+        if image is not None:
+            logging.debug(f"photo prefetch used, stats: {prefetch_stats}")
+            return image
+    return _capture_photo(width)
 
 
 def resize_image(image, target_width, target_height):
@@ -108,14 +554,519 @@ def resize_image_to_width(image, target_width):
     return resized_image
 
 
-def show_image(image):
+@functools.lru_cache(maxsize=32)
+def _letterbox_geometry(original_width, original_height, target_width, target_height):
+    # same geometry as resize_image, computed once per input/output size pair
+    scale_ratio = min(target_width / original_width, target_height / original_height)
+    new_width = max(1, int(original_width * scale_ratio))
+    new_height = max(1, int(original_height * scale_ratio))
+    paste_x = (target_width - new_width) // 2
+    paste_y = (target_height - new_height) // 2
+    return new_width, new_height, paste_x, paste_y
+
+
+def letterbox_array(frame, target_width, target_height, out=None):
+    """
+    Resizes a numpy frame to fit within the specified dimensions while maintaining aspect ratio,
+    the fast path of resize_image for camera frames, no PIL round trip.
+
+    Parameters:
+    - frame (numpy.ndarray): The original HxW or HxWxC frame.
+    - target_width (int): The desired width.
+    - target_height (int): The desired height.
+    - out (numpy.ndarray, optional): A preallocated output canvas of the target size to reuse.
+
+    Returns:
+    - canvas (numpy.ndarray): The resized frame padded with black.
+    """
+    import cv2
+    original_height, original_width = frame.shape[:2]
+    new_width, new_height, x, y = _letterbox_geometry(original_width, original_height,
+                                                      target_width, target_height)
+    if out is None:
+        out = np.zeros((target_height, target_width) + frame.shape[2:], dtype=frame.dtype)
+    else:
+        # only the borders need clearing, the inner area is overwritten below
+        out[:y] = 0
+        out[y + new_height:] = 0
+        out[:, :x] = 0
+        out[:, x + new_width:] = 0
+
+    view = out[y:y + new_height, x:x + new_width]
+    resized = cv2.resize(frame, (new_width, new_height), dst=view, interpolation=cv2.INTER_AREA)
+    if not np.shares_memory(resized, view):
+        view[...] = resized
+    return out
+
+
+def resize_array_to_width(frame, target_width):
+    """
+    Resizes a numpy frame while maintaining the aspect ratio based on the target width.
+
+    Parameters:
+    - frame (numpy.ndarray): The original frame.
+    - target_width (int): The desired width.
+
+    Returns:
+    - resized_frame (numpy.ndarray): The resized frame.
+    """
+    import cv2
+    original_height, original_width = frame.shape[:2]
+    if original_width == target_width:
+        return frame
+    target_height = int(target_width * original_height / original_width)
+    return cv2.resize(frame, (target_width, target_height), interpolation=cv2.INTER_AREA)
+
+
+def resize_pyramid(image_path, output_dir, dimensions=RESIZE_DIMENSIONS, force=False):
+    """
+    Resizes one image to all the dimensions with a single decode. The sizes are made from the
+    largest to the smallest, each one downscaled from the previous level instead of the original.
+
+    Parameters:
+    - image_path (str): The path of the original image.
+    - output_dir (str): The folder for the resized images, named <name>_<extension>_<width>p.jpg, the
+      source extension keeps "a.jpg" and "a.png" of one folder from writing the same files.
+    - dimensions (list): The (width, height) sizes to make.
+    - force (bool): Resize even if the outputs are newer than the original.
+
+    Returns:
+    - output_paths (list): The paths written, empty if all outputs were up to date.
+    """
+    name, extension = os.path.splitext(os.path.basename(image_path))
+    name = f"{name}_{extension.lstrip('.')}"
+    source_mtime = os.path.getmtime(image_path)
+    targets = []
+    for w, h in dimensions:
+        output_path = os.path.join(output_dir, f"{name}_{w}p.jpg")
+        if force or not os.path.exists(output_path) or os.path.getmtime(output_path) < source_mtime:
+            targets.append((w, h, output_path))
+    if not targets:
+        return []
+
+    targets.sort(key=lambda target: target[0] * target[1], reverse=True)
+    with Image.open(image_path) as image:
+        # let the JPEG decoder scale down while decoding when the largest size allows it
+        image.draft("RGB", (targets[0][0], targets[0][1]))
+        image = image.convert("RGB")
+
+    level = image
+    for w, h, output_path in targets:
+        new_width, new_height, paste_x, paste_y = _letterbox_geometry(image.width, image.height, w, h)
+        if level.width < new_width or level.height < new_height:
+            level = image
+        level = level.resize((new_width, new_height), Image.LANCZOS)
+
+        new_image = Image.new('RGB', (w, h), (0, 0, 0))
+        new_image.paste(level, (paste_x, paste_y))
+        new_image.save(output_path)
+    return [output_path for w, h, output_path in targets]
+
+
+def resize_batch(input_dir, output_dir, dimensions=RESIZE_DIMENSIONS, workers=None, force=False):
+    """
+    Resizes every image in a folder to all the dimensions, spread across a process pool.
+    Images whose outputs are newer than the original are skipped.
+
+    Parameters:
+    - input_dir (str): The folder with the original images.
+    - output_dir (str): The folder for the resized images.
+    - dimensions (list): The (width, height) sizes to make.
+    - workers (int, optional): The number of processes, default is the CPU count.
+    - force (bool): Resize even if the outputs are up to date.
+
+    Returns:
+    - written (int): The number of images resized.
+    - skipped (int): The number of images already up to date.
+    """
+    image_paths = sorted(os.path.join(input_dir, f) for f in os.listdir(input_dir)
+                         if f.lower().endswith(RESIZE_EXTENSIONS))
+    os.makedirs(output_dir, exist_ok=True)
+
+    written = 0
+    skipped = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(resize_pyramid, path, output_dir, dimensions, force): path
+                   for path in image_paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                output_paths = future.result()
+            except Exception as e:
+                logging.error(f"resize {path} error: {e}")
+                continue
+            if output_paths:
+                written += 1
+                logging.info(f"save {', '.join(output_paths)}")
+            else:
+                skipped += 1
+                logging.debug(f"{path} is up to date")
+    return written, skipped
+
+
+def benchmark_resize(image, iterations=50):
+    """
+    Compares the PIL resize functions with the numpy/OpenCV fast path.
+
+    Parameters:
+    - image (PIL.Image): The image to resize.
+    - iterations (int): The number of runs for each function.
+
+    Returns:
+    - results (dict): The average milliseconds per call for each function.
+    """
+    image = image.convert("RGB")
+    frame = np.asarray(image)
+    canvas = np.zeros((DISPLAY_HEIGHT, DISPLAY_WIDTH, 3), dtype=np.uint8)
+    cases = {
+        "resize_image": lambda: resize_image(image, DISPLAY_WIDTH, DISPLAY_HEIGHT),
+        "letterbox_array": lambda: letterbox_array(frame, DISPLAY_WIDTH, DISPLAY_HEIGHT),
+        "letterbox_array(out)": lambda: letterbox_array(frame, DISPLAY_WIDTH, DISPLAY_HEIGHT, out=canvas),
+        "resize_image_to_width": lambda: resize_image_to_width(image, DISPLAY_WIDTH),
+        "resize_array_to_width": lambda: resize_array_to_width(frame, DISPLAY_WIDTH),
+    }
+    results = {}
+    for name, func in cases.items():
+        func()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        results[name] = (time.perf_counter() - start) * 1000 / iterations
+    return results
+
+
+class TextOverlay:
+    """
+    A text label drawn on top of every frame the compositor renders.
+    """
+    def __init__(self, text, position=(10, 30), color=(255, 255, 255), scale=0.8, thickness=2):
+        self.text = text
+        self.position = position
+        self.color = color
+        self.scale = scale
+        self.thickness = thickness
+
+    def draw(self, canvas):
+        import cv2
+        cv2.putText(canvas, self.text, self.position, cv2.FONT_HERSHEY_SIMPLEX,
+                    self.scale, self.color, self.thickness, cv2.LINE_AA)
+
+
+class BoxOverlay:
+    """
+    A rectangle with an optional label, such as a detected gesture bounding box.
+    """
+    def __init__(self, x1, y1, x2, y2, label=None, color=(0, 0, 0), thickness=2):
+        self.box = (x1, y1, x2, y2)
+        self.label = label
+        self.color = color
+        self.thickness = thickness
+
+    def draw(self, canvas):
+        import cv2
+        x1, y1, x2, y2 = self.box
+        cv2.rectangle(canvas, (x1, y1), (x2, y2), self.color, self.thickness)
+        if self.label:
+            cv2.putText(canvas, self.label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX,
+                        0.8, self.color, self.thickness, cv2.LINE_AA)
+
+
+class DisplayCompositor:
+    """
+    Owns the display and renders everything from a single thread.
+
+    Submitted frames are coalesced, only the latest pending frame is drawn, so producers
+    never block on the panel and stale images never pile up. Overlays are drawn on a copy
+    of the frame in NumPy, renders are paced to the measured time of a panel write, and a
+    still image always ends a GIF that is playing.
+
+    Overlays set with set_overlay() stay on every frame until removed. Overlays given with
+    show() belong to that frame only, the next frame drops them.
+    """
+    def __init__(self, display, max_fps=DISPLAY_MAX_FPS):
+        self._display = display
+        self._min_interval = 1.0 / max_fps if max_fps else 0
+        self._cond = threading.Condition()
+        self._pending = None
+        self._pending_key = None
+        self._pending_overlays = []
+        self._base = None
+        self._base_key = None
+        self._base_overlays = []
+        self._dirty = False
+        self._overlays = {}
+        self._display_seconds = 0.0
+        self._gif_frames = None
+        self._gif_index = 0
+        self._gif_due = 0
+        self._gif_done = threading.Event()
+        self._gif_done.set()
+        self._last_render = 0
+        self._submitted = 0
+        self._dropped = 0
+        self._skipped = 0
+        self._rendered = 0
+        self._thread = threading.Thread(target=self._render_loop, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _to_array(image):
+        if isinstance(image, np.ndarray):
+            return image
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return np.asarray(image)
+
+    def show(self, image, overlays=None, key=None):
+        """
+        Queues an image for display without blocking, replacing any frame not drawn yet.
+
+        Parameters:
+        - image (PIL.Image or numpy.ndarray): The RGB image to display.
+        - overlays (dict, optional): Named overlays drawn on this image only, such as a box around
+          a detected hand, the next image is drawn without them.
+        - key (str, optional): Identifies the image, it is not drawn again while the same key is on screen.
+        """
+        with self._cond:
+            if key is not None and not overlays and self._gif_frames is None:
+                current_key = self._pending_key if self._pending is not None else self._base_key
+                if key == current_key:
+                    self._skipped += 1
+                    return
+
+        frame = self._to_array(image)
+        with self._cond:
+            self._submitted += 1
+            if self._pending is not None:
+                self._dropped += 1
+            self._pending = frame
+            self._pending_key = key
+            self._pending_overlays = [overlay for overlay in (overlays or {}).values() if overlay is not None]
+            self._stop_gif()
+            self._cond.notify()
+
+    def set_overlay(self, name, overlay):
+        """
+        Adds, replaces or (with None) removes a named overlay that stays on every frame, and
+        redraws the current frame.
+
+        Parameters:
+        - name (str): The overlay name.
+        - overlay (TextOverlay or BoxOverlay): The overlay, or None to remove it.
+        """
+        with self._cond:
+            if overlay is None:
+                self._overlays.pop(name, None)
+            else:
+                self._overlays[name] = overlay
+            self._dirty = True
+            self._cond.notify()
+
+    def play_gif(self, frames, wait=True):
+        """
+        Plays GIF frames on the render thread until they finish or a still image arrives.
+
+        Parameters:
+        - frames (list): A list of (image, duration in ms) tuples.
+        - wait (bool): Block until the GIF has finished or has been interrupted.
+        """
+        frames = [(self._to_array(image), duration) for image, duration in frames]
+        if not frames:
+            return
+        with self._cond:
+            self._stop_gif()
+            self._gif_frames = frames
+            self._gif_index = 0
+            self._gif_due = time.monotonic()
+            self._gif_done = done = threading.Event()
+            self._cond.notify()
+        if wait:
+            done.wait()
+
+    def _stop_gif(self):
+        self._gif_frames = None
+        self._gif_done.set()
+
+    def stats(self):
+        """
+        Returns the compositor counters.
+
+        Returns:
+        - stats (dict): The submitted, dropped (coalesced), skipped (already on screen) and rendered frame
+          counts, and the mean milliseconds of a panel write.
+        """
+        with self._cond:
+            return {"submitted": self._submitted, "dropped": self._dropped,
+                    "skipped": self._skipped, "rendered": self._rendered,
+                    "display_ms": round(self._display_seconds * 1000, 1)}
+
+    def _next_frame(self):
+        # called with the condition held, returns the frame to render or waits for one
+        while True:
+            if self._pending is not None:
+                frame, self._pending = self._pending, None
+                self._base_key = self._pending_key
+                self._base_overlays = self._pending_overlays
+                self._dirty = False
+                return frame
+            if self._gif_frames is not None:
+                now = time.monotonic()
+                if now < self._gif_due:
+                    self._cond.wait(self._gif_due - now)
+                    continue
+                if self._gif_index >= len(self._gif_frames):
+                    self._stop_gif()
+                    continue
+                frame, duration = self._gif_frames[self._gif_index]
+                self._gif_index += 1
+                self._gif_due = now + duration / 1000
+                self._base_key = None
+                self._base_overlays = []
+                self._dirty = False
+                return frame
+            if self._dirty and self._base is not None:
+                self._dirty = False
+                return self._base
+            self._cond.wait()
+
+    def _render_loop(self):
+        while True:
+            with self._cond:
+                frame = self._next_frame()
+                self._base = frame
+                overlays = list(self._overlays.values()) + self._base_overlays
+
+            # a panel write that returns before the panel is done is not followed by another one sooner
+            delay = self._last_render + max(self._min_interval, self._display_seconds) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            canvas = frame
+            if overlays:
+                canvas = frame.copy()
+                for overlay in overlays:
+                    overlay.draw(canvas)
+            self._last_render = time.monotonic()
+            try:
+                self._display.display(canvas)
+            except Exception as e:
+                logging.error(f"display error: {e}")
+            seconds = time.monotonic() - self._last_render
+            self._display_seconds = seconds if not self._rendered else 0.8 * self._display_seconds + 0.2 * seconds
+            with self._cond:
+                self._rendered += 1
+
+
+_compositor = None
+_compositor_lock = threading.Lock()
+
+def get_compositor():
+    """
+    Returns the shared display compositor, it is created on first use.
+
+    Returns:
+    - compositor (DisplayCompositor): The display compositor.
+    """
+    global _compositor
+    with _compositor_lock:
+        if _compositor is None:
+            _compositor = DisplayCompositor(get_display())
+        return _compositor
+
+class AssetCache:
+    """
+    Loads each display asset once and keeps it fitted to the display size as an RGB array,
+    so showing a cartoon never decodes or resizes the file again.
+    """
+    def __init__(self, folder=ASSET_DIR, width=DISPLAY_WIDTH, height=DISPLAY_HEIGHT):
+        self._folder = folder
+        self._width = width
+        self._height = height
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """
+        Returns the asset, loading it on first use.
+
+        Parameters:
+        - name (str): The file name in the asset folder, such as "hello.png".
+
+        Returns:
+        - frame (numpy.ndarray): The read-only RGB frame of the display size.
+        """
+        with self._lock:
+            frame = self._assets.get(name)
+        if frame is not None:
+            return frame
+
+        with Image.open(os.path.join(self._folder, name)) as image:
+            image = image.convert("RGB")
+        if image.size != (self._width, self._height):
+            image = resize_image(image, self._width, self._height)
+        frame = np.array(image)
+        frame.flags.writeable = False
+        with self._lock:
+            self._assets[name] = frame
+        return frame
+
+    def preload(self):
+        """
+        Loads every image in the asset folder.
+        """
+        for name in sorted(os.listdir(self._folder)):
+            if name.lower().endswith(RESIZE_EXTENSIONS):
+                try:
+                    self.get(name)
+                except Exception as e:
+                    logging.error(f"load asset {name} error: {e}")
+
+
+_assets = None
+_assets_lock = threading.Lock()
+
+def get_assets():
+    """
+    Returns the shared display asset cache.
+
+    Returns:
+    - assets (AssetCache): The asset cache.
+    """
+    global _assets
+    with _assets_lock:
+        if _assets is None:
+            _assets = AssetCache()
+        return _assets
+
+def show_asset(name):
+    """
+    Displays a cached asset, nothing is redrawn if it is already on the display.
+
+    Parameter:
+    - name (str): The file name in the asset folder, such as "hello.png".
+    """
+    get_compositor().show(get_assets().get(name), key=name)
+
+def show_image(image, overlays=None):
     """
     Displays the given image on the initialized display.
 
     Parameter:
-    - image (PIL.Image): The image to display.
+    - image (PIL.Image or numpy.ndarray): The image to display.
+    - overlays (dict, optional): Named overlays drawn on this image only, use set_overlay() for
+      overlays that stay.
+    """
+    get_compositor().show(image, overlays)
+
+def set_overlay(name, overlay):
+    """
+    Sets or (with None) removes a named overlay drawn on top of the displayed image.
+
+    Parameters:
+    - name (str): The overlay name.
+    - overlay (TextOverlay or BoxOverlay): The overlay, or None to remove it.
     """
-    disp.display(image)
+    get_compositor().set_overlay(name, overlay)
 
 def show_image_from_path(image_path):
     """
@@ -125,7 +1076,7 @@ def show_image_from_path(image_path):
     - image_path (str): The file path of the image to display.
     """
     with Image.open(image_path) as image:
-        disp.display(image)
+        show_image(image.convert("RGB"))
 
 def init_gifplayer(folder):
     """
@@ -137,7 +1088,7 @@ def init_gifplayer(folder):
     Returns:
     - gif_player (AnimatedGif): The initialized GIF player instance.
     """
-    gif_player = AnimatedGif(disp, width=320, height=240, folder=folder)
+    gif_player = AnimatedGif(get_display(), width=DISPLAY_WIDTH, height=DISPLAY_HEIGHT, folder=folder)
     gif_player.preload()
     return gif_player
 
@@ -149,7 +1100,7 @@ def show_gif(gifplayer):
     Parameter:
     - gifplayer (AnimatedGif): The GIF player instance.
     """
-    gifplayer.play()
+    get_compositor().play_gif(gifplayer.frames())
 
 
 def main():
@@ -180,18 +1131,40 @@ def main():
             show_image_from_path(origin_path)
         elif user_input == 'resize':
             origin_path = input("input the jpg file path: ").strip().lower()
-            dimensions = [
-                (720, 1080),
-                (480, 720),
-                (320, 480),
-                (240, 320),
-            ]
             with Image.open(origin_path) as image:
-                for w,h in dimensions:
+                for w,h in RESIZE_DIMENSIONS:
                     output_path = f'{w}p.jpg'
                     resize_img = resize_image(image, w, h)
                     resize_img.save(output_path)
                     logging.info(f"save {output_path}")
+        elif user_input == 'batch':
+            input_dir = input("input the image folder: ").strip()
+            output_dir = input("input the output folder: ").strip()
+            written, skipped = resize_batch(input_dir, output_dir)
+            logging.info(f"batch resize end, {written} images resized, {skipped} up to date")
+        elif user_input == 'bench':
+            origin_path = input("input the jpg file path: ").strip()
+            with Image.open(origin_path) as image:
+                logging.info(f"image size: {image.width} x {image.height}")
+                for name, ms in benchmark_resize(image).items():
+                    logging.info(f"{name}: {ms:.2f}ms")
+        elif user_input == 'import':
+            import_ms = measure_import_time()
+            logging.info(f"import time: {import_ms:.1f}ms, budget: {IMPORT_TIME_BUDGET_MS}ms")
+            if import_ms > IMPORT_TIME_BUDGET_MS:
+                logging.warning("import time is over budget!")
+        elif user_input == 'prefetch':
+            get_camera().stop()
+            start = time.perf_counter()
+            take_photo(width=320)
+            cold = (time.perf_counter() - start) * 1000
+            get_camera().stop()
+            prefetch_photo(width=320)
+            time.sleep(CAMERA_READ_TIMEOUT)
+            start = time.perf_counter()
+            take_photo(width=320)
+            logging.info(f"take_photo cold: {cold:.0f}ms, prefetched: {(time.perf_counter() - start) * 1000:.0f}ms, "
+                         f"stats: {prefetch_stats}")
         elif user_input == 'gif':
             player = init_gifplayer("../cartoons/")
             show_gif(player)
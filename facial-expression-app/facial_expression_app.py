@@ -31,22 +31,26 @@ from api import media_api
 
 def expression_from_face(expression):
     if expression == 'happy':
-        media_api.show_image_from_path('../cartoons/Hop.jpg')
+        media_api.show_asset('Hop.jpg')
     elif expression == 'neutral':
-        media_api.show_image_from_path('../cartoons/Trot.jpg')
+        media_api.show_asset('Trot.jpg')
     elif expression == 'sad':
-        media_api.show_image_from_path('../cartoons/Low battery.jpg')
+        media_api.show_asset('Low battery.jpg')
     else:
-        media_api.show_image_from_path('../cartoons/Rest (waiting).jpg')
+        media_api.show_asset('Rest (waiting).jpg')
 
 def main():
     model = facial_expression_api.get_model()
-    cap = cv2.VideoCapture(0)
+    camera = media_api.get_camera()
+    timestamp = None
     
     while True:
         start_time = time.time()
         
-        ret, frame = cap.read()
+        timestamp, frame = camera.latest_frame(newer_than=timestamp)
+        if frame is None:
+            print("No camera frame!")
+            break
         frame = cv2.resize(frame, (320, 240))
         
         frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -54,9 +58,8 @@ def main():
         expression = facial_expression_api.get_facial_expression(frame_rgb, model)
         
         if expression == "":
-            cap.release()
+            camera.stop()
             cv2.destroyAllWindows()
-            cap = cv2.VideoCapture(0)
             break
         else:
             expression_from_face(expression)
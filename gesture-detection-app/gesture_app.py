@@ -27,8 +27,7 @@ import threading
 import time
 
 sys.path.append("..")
-from api import move_api
-from MangDang.LCD.ST7789 import ST7789
+from api import move_api, media_api
 
 def gesture_look_up(gesture, gestures_dict):
     start_msg = {**move_api._MSG, "ry": 1.0}
@@ -57,10 +56,10 @@ def gesture_look_right(gesture, gestures_dict):
 gestures_dict = {'come': move_api.move_forward, 'stop': move_api.move_forward, 'look up': gesture_look_up,
                  'look right': gesture_look_right, 'look left': gesture_look_left, 'look down': gesture_look_down}
 
-def movement_from_gesture(cap, gesture):
+def movement_from_gesture(camera, gesture):
     if gesture == 'quit':
         # Release resources
-        cap.release()
+        camera.stop()
         cv2.destroyAllWindows()
     elif gesture == "look up":
         gesture_thread = threading.Thread(target=gesture_look_up, args=[gesture, gestures_dict])
@@ -78,14 +77,16 @@ def movement_from_gesture(cap, gesture):
 def main():
     model = gesture_api.get_model()
     count = 0
-    cap = cv2.VideoCapture(0)
-    disp = ST7789()
-    disp.begin()
+    camera = media_api.get_camera()
+    timestamp = None
     
     while True:
         start_time = time.time()
 
-        ret, frame = cap.read()
+        timestamp, frame = camera.latest_frame(newer_than=timestamp)
+        if frame is None:
+            print("No camera frame!")
+            break
         frame = cv2.resize(frame, (320, 240))
         H, W, _ = frame.shape
         # Flip the frame
@@ -102,20 +103,18 @@ def main():
             x2 = int(max(x_) * W) - 10
             y2 = int(max(y_) * H) - 10
 
-            cv2.rectangle(frame_rgb, (x1, y1), (x2, y2), (0, 0, 0), 2)
-            cv2.putText(frame_rgb, gesture, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2, cv2.LINE_AA)
-
-            disp.display(frame_rgb)
+            gesture_box = media_api.BoxOverlay(x1, y1, x2, y2, label=gesture)
+            media_api.show_image(frame_rgb, overlays={"gesture": gesture_box})
 
             if gesture == "quit":
                 count += 1
                 if count == 3:
-                    cap.release()
+                    camera.stop()
                     cv2.destroyAllWindows()
                     break
             else:
                 count = 0
-                movement_from_gesture(cap, gesture)
+                movement_from_gesture(camera, gesture)
 
         # Control frame rate
         elapsed_time = time.time() - start_time